@@ -0,0 +1,182 @@
+"""
+Scaling benchmark for the sync.
+
+It times the duplicate removal of fetched Snipe objects and the name uniqueness index over synthetic
+asset lists of growing size and fails if the time per asset grows with the inventory, i.e. if one of
+these hot paths turned quadratic again.
+
+    python benchmark.py --sizes 1000 2000 4000 8000 16000
+
+With --mock the whole sync runs against the local Snipe-IT and NetBox stand-ins of mockserver.py, twice per
+size: the initial sync creating everything and a resync with nothing changed. Per phase it reports the wall
+time, the requests and bytes of both servers and the peak memory allocated by Python.
+
+    python benchmark.py --mock --sizes 1000 10000 100000 --latency 0.005
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+import snipe
+import syncer
+
+
+def make_assets(count: int):
+    # every fifth asset shares its name with another one, every page overlaps the previous one a bit
+    assets = []
+    for i in range(count):
+        assets.append({'id': i + 1,
+                       'name': "Asset {}".format(i - i % 2 if i % 5 == 0 else i),
+                       'asset_tag': "T{:06d}".format(i + 1)})
+    return assets + assets[-count // 20:]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(count: int):
+    assets = make_assets(count)
+    dedup = timed(lambda rows: list(snipe.unique_by_id(rows)), assets)
+
+    def uniqueness(rows):
+        counts = syncer.Syncer.count_names(rows)
+        return [counts[syncer.normalize(row['name'])] <= 1 for row in rows]
+
+    names = timed(uniqueness, assets)
+    return dedup, names
+
+
+class MockServers:
+    """
+    The servers of mockserver.py in a child process, so their memory does not count for the sync
+    """
+
+    def __init__(self, assets: int, latency: float):
+        self.process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mockserver.py"),
+                                         "--assets", str(assets), "--latency", str(latency)],
+                                        stdout=subprocess.PIPE, text=True)
+        self.snipe_url, self.netbox_url = self.process.stdout.readline().split()
+
+    def stats(self):
+        totals = {'requests': 0, 'received': 0, 'sent': 0}
+        for url in (self.snipe_url, self.netbox_url):
+            with urllib.request.urlopen(url + "/_stats") as response:
+                for key, value in json.load(response).items():
+                    totals[key] += value
+        return totals
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+def sync_phases(snipe_client, sync):
+    def models():
+        manufacturers, device_types = snipe_client.get_models_and_manufacturers_with_mac()
+        sync.sync_manufacturers(manufacturers)
+        sync.sync_models_to_device_types(device_types)
+
+    def locations():
+        snipe_locations = snipe_client.get_locations()
+        sync.sync_top_locations_to_sites(snipe_locations)
+        sync.sync_locations(snipe_locations)
+
+    def assets():
+        asset_macs = sync.sync_assets_to_devices(snipe_client.iter_assets_with_mac(model_ids=snipe_client.mac_model_ids), False, False)
+        sync.sync_interfaces(asset_macs)
+
+    return [('custom_field', lambda: sync.ensure_netbox_custom_field(False)),
+            ('companies', lambda: sync.sync_companies_to_tenants(snipe_client.get_companies())),
+            ('models', models),
+            ('locations', locations),
+            ('assets', assets)]
+
+
+def run_mock(count: int, args):
+    """
+    Runs the initial sync and a resync against fresh mock servers, returns the seconds per asset of the initial sync
+    """
+    import pynetbox
+    from cache import NetboxCache
+    from state import StateStore
+
+    per_asset = None
+    with MockServers(count, args.latency) as servers, tempfile.TemporaryDirectory() as directory:
+        for run_name in ("initial", "resync"):
+            snipe_client = snipe.Snipe(servers.snipe_url, "token", args.concurrency)
+            state = StateStore(os.path.join(directory, "state.db"))
+            sync = syncer.Syncer(pynetbox.api(servers.netbox_url, "token"), snipe_client, True, True, args.batch_size,
+                                 NetboxCache(state), state, [], args.workers)
+
+            total = 0.0
+            for phase, func in sync_phases(snipe_client, sync):
+                before = servers.stats()
+                tracemalloc.start()
+                start = time.perf_counter()
+                # the Snipe client prints every fetched page
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    func()
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                after = servers.stats()
+                total += seconds
+                print("{:>8} {:>8} {:>13} {:>10.3f} {:>9} {:>11.1f} {:>11.1f} {:>10.1f}".format(
+                    count, run_name, phase, seconds, after['requests'] - before['requests'],
+                    (after['received'] - before['received']) / 1024, (after['sent'] - before['sent']) / 1024, peak / 2 ** 20))
+
+            failures = len(sync.writer.failures)
+            print("{:>8} {:>8} {:>13} {:>10.3f}{}".format(count, run_name, "total", total,
+                                                       "   {} failed writes".format(failures) if failures else ""))
+            if per_asset is None:
+                per_asset = total / count
+    return per_asset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000, 8000, 16000])
+    parser.add_argument('--max-growth', type=float, default=3.0,
+                        help="allowed growth of the time per asset between the smallest and the largest size")
+    parser.add_argument('--mock', action='store_true', help="run the whole sync against local mock servers")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the mock servers add to every request")
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent requests to Snipe-IT")
+    parser.add_argument('--batch-size', type=int, default=100, help="objects per NetBox bulk request")
+    parser.add_argument('--workers', type=int, default=1, help="threads reconciling assets")
+    args = parser.parse_args()
+
+    if args.mock:
+        logging.basicConfig(level=logging.ERROR)
+        print("{:>8} {:>8} {:>13} {:>10} {:>9} {:>11} {:>11} {:>10}".format(
+            "assets", "run", "phase", "time [s]", "requests", "sent [KiB]", "recv [KiB]", "peak [MiB]"))
+        per_asset = [run_mock(size, args) for size in sorted(args.sizes)]
+        growth = per_asset[-1] / per_asset[0]
+        print("growth of the time per asset: {:.2f}x".format(growth))
+        sys.exit(1 if growth > args.max_growth else 0)
+
+    per_asset = []
+    print("{:>8} {:>12} {:>12} {:>14}".format("assets", "dedup [s]", "names [s]", "per asset [us]"))
+    for size in sorted(args.sizes):
+        dedup, names = run(size)
+        per_asset.append((dedup + names) / size * 1e6)
+        print("{:>8} {:>12.4f} {:>12.4f} {:>14.3f}".format(size, dedup, names, per_asset[-1]))
+
+    growth = per_asset[-1] / per_asset[0]
+    print("growth of the time per asset: {:.2f}x".format(growth))
+    if growth > args.max_growth:
+        print("not scaling linearly")
+        sys.exit(1)
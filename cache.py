@@ -0,0 +1,52 @@
+import logging
+
+from state import StateStore
+
+
+class NetboxCache:
+    """
+    Local snapshot of the NetBox objects per object type, persisted in the state file between runs.
+
+    Loading a type only transfers the objects changed since the snapshot (last_updated__gte the newest
+    change in it). If the object count in NetBox differs afterwards, objects have been deleted and the
+    type is fetched completely again. Writes of the syncer itself are picked up by the next revalidation.
+    """
+
+    def __init__(self, state: StateStore):
+        self.state = state
+
+    @staticmethod
+    def __namespace(kind: str):
+        return "netbox:{}".format(kind)
+
+    def load(self, kind: str, endpoint) -> list:
+        objects = self.state.items(self.__namespace(kind))
+        watermark = self.state.get('netbox_watermark', kind)
+
+        if objects and watermark:
+            changed = {str(item['id']): dict(item) for item in endpoint.filter(last_updated__gte=watermark)}
+            objects.update(changed)
+            if endpoint.count() == len(objects):
+                logging.info("Revalidated cached {}: {} of {} changed".format(kind, len(changed), len(objects)))
+            else:
+                logging.info("Objects of {} have been deleted, fetching all".format(kind))
+                objects = None
+        else:
+            objects = None
+
+        if objects is None:
+            changed = {str(item['id']): dict(item) for item in endpoint.all()}
+            objects = changed
+            self.state.clear(self.__namespace(kind))
+
+        self.state.set_many(self.__namespace(kind), changed)
+        newest = max((item['last_updated'] for item in objects.values() if item.get('last_updated')), default=None)
+        if newest is not None:
+            self.state.set('netbox_watermark', kind, newest)
+
+        return list(objects.values())
+
+    def clear(self):
+        for kind in self.state.items('netbox_watermark'):
+            self.state.clear(self.__namespace(kind))
+        self.state.clear('netbox_watermark')
@@ -0,0 +1,45 @@
+import logging
+
+from state import StateStore
+
+
+class Checkpoint:
+    """
+    Progress of a sync run in the state store: the completed phases with their results, e.g. the fetched Snipe
+    objects. A run interrupted by an error can be resumed, skipping the phases it completed. The assets synced
+    within an interrupted phase are skipped by their digests, which are stored while the batches are sent.
+    """
+
+    def __init__(self, state: StateStore):
+        self.state = state
+
+    def start(self, options: dict, resume: bool = False) -> bool:
+        """
+        Starts a new run or resumes the interrupted one, if it had the same options
+        :return: True if the run is resumed
+        """
+        if resume:
+            stored = self.state.get('checkpoint', 'options')
+            if stored == options:
+                logging.info("Resuming the interrupted run")
+                return True
+            logging.warning("No interrupted run with the same options found, starting a new run" if stored is None else
+                            "The interrupted run had other options, starting a new run")
+        self.clear()
+        self.state.set('checkpoint', 'options', options)
+        return False
+
+    def done(self, phase: str) -> bool:
+        return self.state.get('checkpoint', "phase:" + phase) is not None
+
+    def result(self, phase: str):
+        return self.state.get('checkpoint', "phase:" + phase)['result']
+
+    def complete(self, phase: str, result=None):
+        """
+        :param result: the JSON serializable result of the phase, restored when resuming
+        """
+        self.state.set('checkpoint', "phase:" + phase, {'result': result})
+
+    def clear(self):
+        self.state.clear('checkpoint')
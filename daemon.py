@@ -0,0 +1,138 @@
+import hmac
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class Daemon:
+    """
+    Keeps the sync running: a sync is triggered by a webhook or every poll interval, bursts of webhooks within
+    the debounce time are collected into one sync. The syncer and its NetBox indexes stay in memory between the
+    syncs, so each one only fetches and reconciles the objects changed in Snipe-IT since the last one.
+    The indexes are reloaded every refresh interval to pick up changes made in NetBox by others.
+    """
+
+    def __init__(self, sync, refresh=None, poll_interval: float = 300, debounce: float = 5, max_delay: float = 60,
+                 refresh_interval: float = 3600):
+        """
+        :param sync: runs one sync, called from the daemon thread only
+        :param refresh: drops the in-memory NetBox indexes
+        :param max_delay: longest time a sync is postponed by a steady stream of webhooks
+        """
+        self.sync = sync
+        self.refresh = refresh
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.refresh_interval = refresh_interval
+        self.condition = threading.Condition()
+        self.server = None
+        self.__pending = False
+        self.__last_event = None
+        self.__stopped = False
+
+    def notify(self, reason: str = "webhook"):
+        """
+        Requests a sync, thread safe
+        """
+        logging.debug("Sync requested by {}".format(reason))
+        with self.condition:
+            self.__pending = True
+            self.__last_event = time.monotonic()
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.__stopped = True
+            self.condition.notify_all()
+        if self.server is not None:
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def listen(self, host: str, port: int, token: str = None):
+        """
+        Accepts webhooks in a background thread. Snipe-IT webhooks only announce that something changed,
+        the changes themselves are fetched from the API.
+        :param token: if set, webhooks have to pass it as ?token= in the URL
+        """
+        self.server = WebhookServer((host, port), self, token)
+        threading.Thread(target=self.server.serve_forever, name="webhooks", daemon=True).start()
+        logging.info("Listening for webhooks on {}:{}".format(*self.server.server_address[:2]))
+        return self.server
+
+    def __wait(self):
+        """
+        Waits for a webhook or the poll interval, then until no webhook came for the debounce time
+        :return: False if the daemon was stopped
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.__pending or self.__stopped, timeout=self.poll_interval)
+            started = time.monotonic()
+            while self.__pending and not self.__stopped:
+                now = time.monotonic()
+                remaining = min(self.__last_event + self.debounce, started + self.max_delay) - now
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            self.__pending = False
+            return not self.__stopped
+
+    def run(self):
+        """
+        Syncs until stop() is called. A failed sync is logged and retried with the next trigger.
+        """
+        refreshed = time.monotonic()
+        self.__run_sync()
+        while self.__wait():
+            if self.refresh is not None and time.monotonic() - refreshed >= self.refresh_interval:
+                logging.info("Reloading the NetBox objects")
+                self.refresh()
+                refreshed = time.monotonic()
+            self.__run_sync()
+
+    def __run_sync(self):
+        start = time.perf_counter()
+        try:
+            self.sync()
+            logging.info("Synced in {:.3f}s".format(time.perf_counter() - start))
+        except Exception:
+            logging.exception("Sync failed, retrying with the next trigger")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, daemon: Daemon, token: str = None):
+        super().__init__(address, WebhookHandler)
+        self.daemon = daemon
+        self.token = token
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug("Webhook {}".format(format % args))
+
+    def __reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        token = dict(parse_qsl(urlsplit(self.path).query)).get('token', "")
+        if self.server.token and not hmac.compare_digest(token, self.server.token):
+            self.__reply(403, {'detail': "Invalid token."})
+            return
+        self.server.daemon.notify("webhook from {}".format(self.client_address[0]))
+        self.__reply(202, {'detail': "Sync queued."})
+
+    def do_GET(self):
+        # health check
+        self.__reply(200, {'status': "running"})
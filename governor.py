@@ -0,0 +1,197 @@
+import email.utils
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from requests.adapters import HTTPAdapter
+
+# responses telling the client to slow down
+THROTTLED = (429, 503)
+# a 503 may come after the server processed the request, only requests without side effects are repeated then
+IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS')
+
+
+def retry_after(response):
+    """
+    Seconds to wait according to the Retry-After header, None without one
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, (email.utils.parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class Governor:
+    """
+    Paces the requests to one service. A token bucket limits the request rate, if one is configured, and the number
+    of requests in flight adapts like TCP congestion control (AIMD): it grows by one per round of successful
+    requests and is halved when the service throttles (429/503) or answers slower than the target latency.
+    A Retry-After pauses all requests to the service.
+    """
+
+    def __init__(self, service: str, max_concurrency: int = 4, rate: float = 0, target_latency: float = 0, window: float = 10):
+        """
+        :param rate: requests per second, 0 for no limit
+        :param target_latency: seconds, slower responses reduce the concurrency, 0 to ignore the latency
+        :param window: seconds over which the current rate is measured
+        """
+        self.service = service
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = rate
+        self.target_latency = target_latency
+        self.window = window
+        self.condition = threading.Condition()
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        self.requests = 0
+        self.waited = 0.0
+        self.__tokens = max(1.0, rate)
+        self.__refilled = time.monotonic()
+        self.__paused_until = 0.0
+        self.__decreased = 0.0
+        self.__completed = deque()
+
+    def __take_token(self, now: float) -> float:
+        """
+        :return: seconds until a token is available, 0 if one was taken
+        """
+        if not self.rate:
+            return 0.0
+        self.__tokens = min(max(1.0, self.rate), self.__tokens + (now - self.__refilled) * self.rate)
+        self.__refilled = now
+        if self.__tokens >= 1:
+            self.__tokens -= 1
+            return 0.0
+        return (1 - self.__tokens) / self.rate
+
+    def acquire(self):
+        """
+        Blocks until the request may be sent
+        """
+        start = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.__paused_until:
+                    self.condition.wait(self.__paused_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    delay = self.__take_token(now)
+                    if not delay:
+                        break
+                    self.condition.wait(delay)
+            self.in_flight += 1
+            self.waited += time.monotonic() - start
+
+    def release(self, response, elapsed: float):
+        """
+        Adapts the concurrency to the outcome of a request
+        :param response: None if the request failed without a response
+        """
+        now = time.monotonic()
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            self.__completed.append(now)
+            throttled = response is not None and response.status_code in THROTTLED
+            slow = bool(self.target_latency) and elapsed > self.target_latency
+            if throttled:
+                self.throttled += 1
+            if throttled or slow:
+                # the responses to the requests sent at the same time report the same congestion, decrease once per round trip
+                if now - self.__decreased > elapsed:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.__decreased = now
+                    logging.info("{} {}, reducing to {} concurrent requests".format(
+                        self.service, "throttles" if throttled else "responds slowly", int(self.limit)))
+            elif response is not None and response.ok:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def pause(self, seconds: float):
+        """
+        Holds back all requests for the given time
+        """
+        with self.condition:
+            self.__paused_until = max(self.__paused_until, time.monotonic() + seconds)
+
+    def reset(self):
+        """
+        Clears the counters, the adapted concurrency is kept
+        """
+        with self.condition:
+            self.throttled = 0
+            self.requests = 0
+            self.waited = 0.0
+
+    def current_rate(self) -> float:
+        """
+        Completed requests per second within the window
+        """
+        now = time.monotonic()
+        with self.condition:
+            while self.__completed and self.__completed[0] < now - self.window:
+                self.__completed.popleft()
+            return len(self.__completed) / self.window
+
+    def to_dict(self) -> dict:
+        rate = self.current_rate()
+        with self.condition:
+            return {'rate': round(rate, 3), 'concurrency_limit': int(self.limit), 'requests': self.requests,
+                    'throttled': self.throttled, 'waited_seconds': round(self.waited, 3)}
+
+
+class GovernedAdapter(HTTPAdapter):
+    """
+    Sends every request through the governor. Throttled requests are repeated after the Retry-After of the
+    service, or an exponential backoff without one.
+    """
+
+    def __init__(self, governor: Governor, retries: int = 5, backoff_factor: float = 0.5, **kwargs):
+        self.governor = governor
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.governor.acquire()
+            response = None
+            start = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            finally:
+                self.governor.release(response, time.monotonic() - start)
+
+            if (response.status_code not in THROTTLED or attempt >= self.retries
+                    or (response.status_code == 503 and request.method not in IDEMPOTENT)):
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = self.backoff_factor * 2 ** attempt
+            logging.warning("{} answered {} to {} {}, retrying in {:.1f}s".format(
+                self.governor.service, response.status_code, request.method, request.url, delay))
+            self.governor.pause(delay)
+            response.close()
+            attempt += 1
+
+
+def mount(session, governor: Governor, **kwargs):
+    """
+    Routes all requests of a requests session through the governor
+    :param kwargs: passed to the HTTPAdapter, e.g. pool_maxsize and max_retries
+    """
+    adapter = GovernedAdapter(governor, **kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
@@ -0,0 +1,91 @@
+import threading
+
+
+def normalize(value):
+    """
+    Normalized form of a name used for case-insensitive matching, None for empty values
+    """
+    if value is None:
+        return None
+    value = str(value).lower().strip()
+    return value if value else None
+
+
+class ObjectIndex:
+    """
+    In-memory lookup tables over a set of NetBox objects.
+
+    Every table is described by a key function that returns the hashable key of an item or None if the
+    item should not be part of that table. Like the former next() scans, the first item for a key wins.
+    """
+
+    def __init__(self, items=(), **keys):
+        self.keys = keys
+        self.lock = threading.RLock()
+        self.__items = {}
+        self.__tables = {name: {} for name in keys}
+        self.__item_keys = {}
+
+        for item in items:
+            self.add(item)
+
+    def __iter__(self):
+        return iter(list(self.__items.values()))
+
+    def __len__(self):
+        return len(self.__items)
+
+    def add(self, item):
+        """
+        Add an item to the index, an already present item with the same NetBox id is replaced and keeps its
+        place for the keys it still has
+        """
+        with self.lock:
+            old = self.__items.get(item['id'])
+            old_keys = self.__item_keys.pop(id(old), {}) if old is not None else {}
+
+            self.__items[item['id']] = item
+            item_keys = {}
+            for name, func in self.keys.items():
+                key = func(item)
+                old_key = old_keys.get(name)
+                if old_key is not None and old_key == key:
+                    holders = self.__tables[name][key]
+                    holders[self.__position(holders, old)] = item
+                else:
+                    if old_key is not None:
+                        self.__discard(name, old_key, old)
+                    if key is not None:
+                        self.__tables[name].setdefault(key, []).append(item)
+                if key is not None:
+                    item_keys[name] = key
+            self.__item_keys[id(item)] = item_keys
+
+    @staticmethod
+    def __position(holders: list, item) -> int:
+        return next(i for i, holder in enumerate(holders) if holder is item)
+
+    def __discard(self, name: str, key, item):
+        # the next item with the same key takes over
+        holders = self.__tables[name][key]
+        del holders[self.__position(holders, item)]
+        if not holders:
+            del self.__tables[name][key]
+
+    def get(self, name: str, key):
+        if key is None:
+            return None
+        holders = self.__tables[name].get(key)
+        return holders[0] if holders else None
+
+    def get_all(self, name: str, key) -> list:
+        """
+        All items with the key, in the order they were added
+        """
+        if key is None:
+            return []
+        with self.lock:
+            return list(self.__tables[name].get(key, ()))
+
+    def get_by_id(self, netbox_id: int):
+        return self.__items.get(netbox_id)
@@ -1,10 +1,50 @@
 import argparse
 import configparser
+import json
 import logging
+import re
+import signal
 import snipe
 import pynetbox
 import syncer
 import sys
+from collections import Counter
+
+from cache import NetboxCache
+from checkpoint import Checkpoint
+from daemon import Daemon
+from governor import Governor, mount
+from index import normalize
+from metrics import Metrics
+from netbox_client import NetboxClient
+from planner import PlanWriter, apply_plan
+from records import SnipeAsset
+from scheduler import PhaseScheduler
+from state import StateStore
+from writer import BulkWriter
+
+
+# the NetBox object types written while syncing the objects behind a Snipe watermark
+WATERMARK_KINDS = {
+    'companies': ('tenants',),
+    'models': ('manufacturers', 'device_types'),
+    'hardware': ('devices', 'device_roles', 'interfaces', 'mac_addresses'),
+}
+
+
+def failure_count(syncer: syncer.Syncer, endpoint: str) -> int:
+    return sum(1 for kind, *_ in list(syncer.writer.failures) if kind in WATERMARK_KINDS[endpoint])
+
+
+def save_watermark(state: StateStore, snipe: snipe.Snipe, syncer: syncer.Syncer, endpoint: str, failures_before: int):
+    # a dry run changes nothing, a failed object has to be picked up again by the next incremental run
+    if isinstance(syncer.writer, PlanWriter):
+        return
+    if failure_count(syncer, endpoint) > failures_before:
+        logging.warning("Not advancing the {} watermark, there were errors".format(endpoint))
+    elif endpoint in snipe.watermarks:
+        state.set('watermark', endpoint, snipe.watermarks[endpoint])
+
 
 if __name__ == "__main__":
 
@@ -13,37 +53,238 @@ if __name__ == "__main__":
     parser.add_argument('--allow-linking', action='store_true')
     parser.add_argument('--update-unique-existing', action='store_true')
     parser.add_argument('--no-append-assettag', action='store_true')
+    parser.add_argument('--stream', action='store_true', help="sync assets while they are fetched from Snipe-IT")
+    parser.add_argument('--incremental', action='store_true', help="only sync objects changed in Snipe-IT since the last run")
+    parser.add_argument('--full', action='store_true', help="force a full resync, also in incremental mode")
+    parser.add_argument('--workers', type=int, default=1, help="number of threads reconciling assets in parallel")
+    parser.add_argument('--resume', action='store_true', help="continue an interrupted run after the phases it completed")
+    parser.add_argument('--plan', metavar='FILE', help="dry run, write the changes to FILE instead of NetBox")
+    parser.add_argument('--apply', metavar='FILE', help="send the changes planned with --plan to NetBox, without syncing")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running, sync the changes on Snipe-IT webhooks or every poll interval")
+    parser.add_argument('--metrics-file', help="write a summary of the run as JSON, or in the Prometheus textfile format if it ends with .prom")
     args = parser.parse_args()
+    if args.daemon and (args.plan or args.apply or args.resume):
+        parser.error("--daemon can not be combined with --plan, --apply or --resume")
 
     config = configparser.ConfigParser()
     config.read('config.ini')
 
     logging.basicConfig(level=logging.INFO)
 
-    snipe = snipe.Snipe(config['config']['snipe_url'], config['config']['snipe_token'])
-    netbox = pynetbox.api(config['config']['netbox_url'], config['config']['netbox_token'])
-
-    logging.info("Checking Netbox Custom Fields")
-    syncer = syncer.Syncer(netbox, snipe, args.allow_update, args.allow_linking)
-    syncer.ensure_netbox_custom_field(False)
-
-    logging.info("Syncing Companies")
-    snipe_companies = snipe.get_companies()
-    syncer.sync_companies_to_tenants(snipe_companies)
-
-    logging.info("Syncing Manufacturers and Models with MACs")
-    snipe_manufacturers, snipe_models = snipe.get_models_and_manufacturers_with_mac()
-    syncer.sync_manufacturers(snipe_manufacturers)
-    syncer.sync_models_to_device_types(snipe_models)
-
-    logging.info("Syncing Locations")
-    locations = snipe.get_locations()
-    syncer.sync_top_locations_to_sites(locations)
-    syncer.sync_locations(locations)
-    
-    logging.info("Syncing Assets with MACs")
-    assets = snipe.get_assets_with_mac()
-    syncer.sync_assets_to_devices(assets, args.update_unique_existing, args.no_append_assettag)
+    # one governor per service paces the requests of all threads, see governor.py
+    snipe_concurrency = config['config'].getint('snipe_concurrency', fallback=4)
+    snipe_governor = Governor('snipe', snipe_concurrency, config['config'].getfloat('snipe_rate_limit', fallback=0),
+                              config['config'].getfloat('snipe_target_latency', fallback=0))
+    snipe = snipe.Snipe(config['config']['snipe_url'], config['config']['snipe_token'], snipe_concurrency, snipe_governor)
+
+    netbox_concurrency = config['config'].getint('netbox_concurrency', fallback=1)
+    # with pynetbox the concurrent phases and workers each send their own requests
+    netbox_governor = Governor('netbox', max(netbox_concurrency, config['config'].getint('phase_concurrency', fallback=4), args.workers),
+                               config['config'].getfloat('netbox_rate_limit', fallback=0),
+                               config['config'].getfloat('netbox_target_latency', fallback=0))
+    if netbox_concurrency > 1:
+        netbox = NetboxClient(config['config']['netbox_url'], config['config']['netbox_token'], netbox_concurrency,
+                              request_governor=netbox_governor)
+    else:
+        netbox = pynetbox.api(config['config']['netbox_url'], config['config']['netbox_token'])
+        mount(netbox.http_session, netbox_governor, pool_maxsize=netbox_governor.max_concurrency)
+
+    metrics = Metrics()
+    metrics.governors = [snipe_governor, netbox_governor]
+    metrics.instrument(snipe.session, 'snipe', snipe.url)
+    metrics.instrument(netbox.http_session, 'netbox', netbox.base_url)
+    metrics_file = args.metrics_file or config['config'].get('metrics_file', fallback=None)
+    batch_size = config['config'].getint('netbox_batch_size', fallback=100)
+
+    if args.apply:
+        writer = BulkWriter(netbox, syncer.ENDPOINTS, batch_size)
+        # the planned objects carry the Snipe id custom field, which a dry run does not create
+        syncer.Syncer(netbox, snipe, writer=writer).ensure_netbox_custom_field(False)
+        with open(args.apply) as f:
+            apply_plan(writer, json.load(f))
+        metrics.objects = writer.counts
+        if metrics_file:
+            metrics.write(metrics_file)
+        sys.exit()
+
+    state = StateStore(config['config'].get('state_file', fallback='state.db'))
+    incremental = (args.incremental or config['config'].getboolean('incremental', fallback=False)) and not args.full
+    watermarks = state.items('watermark') if incremental else {}
+
+    # a dry run is not recorded, it can simply be repeated, the daemon continues from the watermarks
+    checkpoint = None
+    resumed = False
+    if not args.plan and not args.daemon:
+        checkpoint = Checkpoint(state)
+        options = {option: getattr(args, option) for option in ('allow_update', 'allow_linking', 'update_unique_existing',
+                                                                'no_append_assettag', 'stream', 'full')}
+        resumed = checkpoint.start(options | {'incremental': incremental}, args.resume)
+
+    cache = None
+    if config['config'].getboolean('netbox_cache', fallback=True):
+        cache = NetboxCache(state)
+        if args.full and not resumed:
+            cache.clear()
+    if args.full and not resumed:
+        state.clear('asset_digest')
+
+    fallback_sites = syncer.FALLBACK_SITES
+    if config.has_section('fallback_sites'):
+        # the rules are values, INI keys can not hold ':' or '=' and are lowercased
+        fallback_sites = []
+        for rule_name, rule in config.items('fallback_sites', raw=True):
+            pattern, arrow, site_name = rule.rpartition('->')
+            if not arrow or not pattern.strip() or not site_name.strip():
+                sys.exit("Invalid rule {} in [fallback_sites], expected: regular expression -> Site name".format(rule_name))
+            fallback_sites.append((pattern.strip(), site_name.strip()))
+    fallback_rules = [(re.compile(pattern, re.IGNORECASE), site_name) for pattern, site_name in fallback_sites]
+
+    # a dry run compares all assets, the digests of the last sync are neither used nor updated
+    plan = PlanWriter(syncer.ENDPOINTS, batch_size) if args.plan else None
+    syncer = syncer.Syncer(netbox, snipe, args.allow_update, args.allow_linking, batch_size, cache,
+                           state if plan is None else None, fallback_rules, args.workers, plan)
+    unique_names = args.update_unique_existing or args.no_append_assettag
+    interfaces = config['config'].getboolean('sync_interfaces', fallback=True)
+
+    def fetch_models(results):
+        manufacturers, models = snipe.get_models_and_manufacturers_with_mac(watermarks.get('models'))
+        return manufacturers, models, sorted(snipe.mac_model_ids)
+
+    def fetch_assets(results):
+        model_ids = results['fetch_models'][2]
+        since = watermarks.get('hardware')
+        if not unique_names:
+            return snipe.get_assets_with_mac(since, model_ids), None
+        # the name uniqueness needs all names, the ones of unchanged assets are kept in the state
+        asset_names = state.items('asset_name') if since else {}
+        assets = snipe.get_assets_with_mac(since if asset_names else None, model_ids)
+        if not asset_names:
+            state.clear('asset_name')
+        else:
+            # deleted assets and assets without MAC fields any more no longer count for the uniqueness
+            for asset_id in snipe.get_deleted_asset_ids(since) | snipe.assets_without_mac:
+                if asset_names.pop(str(asset_id), None) is not None:
+                    state.delete('asset_name', str(asset_id))
+        names = {str(asset['id']): normalize(asset['name']) for asset in assets}
+        state.set_many('asset_name', names)
+        return assets, Counter(name for name in (asset_names | names).values() if name)
+
+    def sync_companies(results):
+        syncer.sync_companies_to_tenants(results['fetch_companies'])
+        save_watermark(state, snipe, syncer, 'companies', failures['companies'])
+
+    def sync_manufacturers(results):
+        syncer.sync_manufacturers(results['fetch_models'][0])
+
+    def sync_device_types(results):
+        syncer.sync_models_to_device_types(results['fetch_models'][1])
+        save_watermark(state, snipe, syncer, 'models', failures['models'])
+
+    def sync_assets(results):
+        if 'fetch_assets' in results:
+            assets, name_counts = results['fetch_assets']
+        else:
+            assets, name_counts = snipe.iter_assets_with_mac(watermarks.get('hardware'), results['fetch_models'][2]), None
+        asset_macs = syncer.sync_assets_to_devices(assets, args.update_unique_existing, args.no_append_assettag, name_counts)
+        if not interfaces:
+            save_watermark(state, snipe, syncer, 'hardware', failures['hardware'])
+        return asset_macs
+
+    def sync_interfaces(results):
+        syncer.sync_interfaces(results['assets'])
+        save_watermark(state, snipe, syncer, 'hardware', failures['hardware'])
+
+    # the results of the fetches are kept in the checkpoint together with the watermarks seen so far
+    def stored(encode=lambda result: result):
+        return lambda result: {'result': encode(result), 'watermarks': dict(snipe.watermarks)}
+
+    def restored(decode=lambda result: result):
+        def restore(value):
+            snipe.watermarks.update(value['watermarks'])
+            return decode(value['result'])
+        return restore
+
+    def encode_assets(result):
+        assets, name_counts = result
+        return [dict(asset) for asset in assets], name_counts
+
+    def decode_assets(result):
+        assets, name_counts = result
+        return ([SnipeAsset.from_row(asset, snipe.refs, asset['macs']) for asset in assets],
+                Counter(name_counts) if name_counts is not None else None)
+
+    failures = {endpoint: failure_count(syncer, endpoint) for endpoint in WATERMARK_KINDS}
+
+    # phases only wait for the phases whose NetBox objects they reference, the fetches from Snipe overlap with them
+    scheduler = PhaseScheduler(config['config'].getint('phase_concurrency', fallback=4), checkpoint)
+    scheduler.add('custom_field', lambda results: syncer.ensure_netbox_custom_field(False) if plan is None else None)
+    scheduler.add('fetch_companies', lambda results: snipe.get_companies(watermarks.get('companies')),
+                  encode=stored(), decode=restored())
+    scheduler.add('fetch_models', fetch_models, encode=stored(), decode=restored())
+    # the Site of a Location is found through its ancestors, so Locations are always synced completely
+    scheduler.add('fetch_locations', lambda results: snipe.get_locations(), encode=stored(), decode=restored())
+    scheduler.add('companies', sync_companies, after=('fetch_companies', 'custom_field'))
+    scheduler.add('manufacturers', sync_manufacturers, after=('fetch_models', 'custom_field'))
+    scheduler.add('device_types', sync_device_types, after=('manufacturers',))
+    scheduler.add('sites', lambda results: syncer.sync_top_locations_to_sites(results['fetch_locations']),
+                  after=('fetch_locations', 'custom_field'))
+    scheduler.add('locations', lambda results: syncer.sync_locations(results['fetch_locations']), after=('sites',))
+    asset_dependencies = ('companies', 'device_types', 'locations')
+    if unique_names or not args.stream:
+        # only the assets of the models with a MAC fieldset are fetched
+        scheduler.add('fetch_assets', fetch_assets, after=('fetch_models',), encode=stored(encode_assets), decode=restored(decode_assets))
+        asset_dependencies += ('fetch_assets',)
+    # the result are the MAC fields of the synced assets, kept in the checkpoint for the interfaces
+    scheduler.add('assets', sync_assets, after=asset_dependencies)
+    if interfaces:
+        scheduler.add('interfaces', sync_interfaces, after=('assets',))
+
+    if args.daemon:
+        def sync_changes():
+            # the first sync follows --incremental and --full, the following ones pick up the changes since the last
+            if scheduler.durations:
+                watermarks.clear()
+                watermarks.update(state.items('watermark'))
+                # every sync reports only its own phases, writes and requests
+                scheduler.durations.clear()
+                metrics.reset()
+                syncer.start_run()
+                failures.update({endpoint: failure_count(syncer, endpoint) for endpoint in WATERMARK_KINDS})
+            try:
+                scheduler.run()
+            finally:
+                metrics.phases = dict(scheduler.durations)
+                metrics.objects = syncer.writer.counts
+                if metrics_file:
+                    metrics.write(metrics_file)
+
+        daemon = Daemon(sync_changes, syncer.refresh, config['config'].getfloat('poll_interval', fallback=300),
+                        config['config'].getfloat('debounce', fallback=5),
+                        refresh_interval=config['config'].getfloat('index_refresh_interval', fallback=3600))
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        webhook_listen = config['config'].get('webhook_listen', fallback=None)
+        if webhook_listen:
+            host, _, port = webhook_listen.rpartition(':')
+            daemon.listen(host or '127.0.0.1', int(port), config['config'].get('webhook_token', fallback=None))
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            daemon.stop()
+        sys.exit()
+
+    try:
+        scheduler.run()
+        if checkpoint is not None:
+            checkpoint.clear()
+    finally:
+        metrics.phases = scheduler.durations
+        metrics.objects = syncer.writer.counts
+        if metrics_file:
+            metrics.write(metrics_file)
+    if plan is not None:
+        plan.write(args.plan)
+
     # for asset in assets:
     #     print("{} {}".format(asset['asset_tag'], asset['name']))
 
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+PREFIX = "snipeit_netbox"
+
+
+class Metrics:
+    """
+    Summary of a sync run: the duration per phase, the HTTP requests per service, method and endpoint with
+    their time and bytes, the created, updated, skipped and failed objects per NetBox object type and the
+    state of the request governors.
+    Written as JSON, or in the Prometheus textfile format if the file name ends with .prom.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}
+        # (service, method, endpoint) -> [requests, seconds, bytes sent, bytes received]
+        self.requests = {}
+        self.objects = Counter()
+        # request governors per service, see governor.py
+        self.governors = []
+
+    def reset(self):
+        """
+        Starts the summary of another run
+        """
+        with self.lock:
+            self.started = time.time()
+            self.phases = {}
+            self.requests = {}
+            self.objects = Counter()
+        for governor in self.governors:
+            governor.reset()
+
+    def instrument(self, session, service: str, base_url: str):
+        """
+        Counts every response of the given requests session, endpoints are relative to base_url with ids replaced
+        """
+        base_path = urlsplit(base_url).path.rstrip('/') + '/'
+
+        def record(response, *args, **kwargs):
+            path = urlsplit(response.request.url).path
+            if path.startswith(base_path):
+                path = path[len(base_path):]
+            endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", path.strip('/'))
+            body = response.request.body or b""
+            with self.lock:
+                entry = self.requests.setdefault((service, response.request.method, endpoint), [0, 0.0, 0, 0])
+                entry[0] += 1
+                entry[1] += response.elapsed.total_seconds()
+                entry[2] += len(body)
+                entry[3] += len(response.content)
+
+        session.hooks['response'].append(record)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            requests = [{'service': service, 'method': method, 'endpoint': endpoint, 'requests': count,
+                         'seconds': round(seconds, 3), 'bytes_sent': sent, 'bytes_received': received}
+                        for (service, method, endpoint), (count, seconds, sent, received) in sorted(self.requests.items())]
+        objects = {}
+        for (kind, result), count in sorted(self.objects.items()):
+            objects.setdefault(kind, {})[result] = count
+        return {'started': self.started, 'duration': round(time.time() - self.started, 3),
+                'phases': {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+                'requests': requests, 'objects': objects,
+                'governors': {governor.service: governor.to_dict() for governor in self.governors}}
+
+    def to_prometheus(self) -> str:
+        summary = self.to_dict()
+        lines = []
+
+        def metric(name: str, help_text: str, samples):
+            lines.append("# HELP {}_{} {}".format(PREFIX, name, help_text))
+            lines.append("# TYPE {}_{} gauge".format(PREFIX, name))
+            for labels, value in samples:
+                label_text = ",".join('{}="{}"'.format(key, str(label).replace('"', '\\"')) for key, label in labels.items())
+                lines.append("{}_{}{{{}}} {}".format(PREFIX, name, label_text, value))
+
+        metric("run_timestamp_seconds", "Start of the last sync run", [({}, summary['started'])])
+        metric("run_duration_seconds", "Duration of the last sync run", [({}, summary['duration'])])
+        metric("phase_duration_seconds", "Duration of a sync phase", [({'phase': phase}, seconds) for phase, seconds in summary['phases'].items()])
+        for name, key, help_text in (("requests", 'requests', "HTTP requests"),
+                                     ("request_duration_seconds", 'seconds', "Time spent in HTTP requests"),
+                                     ("request_sent_bytes", 'bytes_sent', "Bytes sent in HTTP request bodies"),
+                                     ("request_received_bytes", 'bytes_received', "Bytes received in HTTP response bodies")):
+            metric(name, help_text, [({'service': r['service'], 'method': r['method'], 'endpoint': r['endpoint']}, r[key])
+                                     for r in summary['requests']])
+        metric("objects", "NetBox objects per sync result", [({'kind': kind, 'result': result}, count)
+                                                              for kind, results in summary['objects'].items()
+                                                              for result, count in results.items()])
+        for name, key, help_text in (("governor_rate", 'rate', "Requests per second at the end of the run"),
+                                     ("governor_concurrency_limit", 'concurrency_limit', "Concurrent requests allowed by the governor"),
+                                     ("governor_throttled_responses", 'throttled', "Responses throttling the client (429/503)"),
+                                     ("governor_wait_seconds", 'waited_seconds', "Time requests waited for the governor")):
+            metric(name, help_text, [({'service': service}, governor[key]) for service, governor in summary['governors'].items()])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        content = self.to_prometheus() if path.endswith('.prom') else json.dumps(self.to_dict(), indent=2)
+        # written to a temporary file first, so a collector never reads a half written file
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
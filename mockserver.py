@@ -0,0 +1,422 @@
+"""
+Local stand-ins for the Snipe-IT and NetBox APIs, for benchmarking the sync without live instances.
+
+The Snipe-IT server serves a synthetic inventory of the given size (hardware, models, fieldsets, locations
+and companies), the NetBox server keeps the objects written by the syncer in memory (tenancy, dcim and
+extras endpoints as used through pynetbox). Both count the requests and bytes they handle, see /_stats.
+
+    python mockserver.py --assets 10000 --latency 0.01
+
+prints the URLs of both servers on the first line and serves until it is terminated.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+SNIPE_MAX_PAGE_SIZE = 500
+NETBOX_PAGE_SIZE = 50
+NETBOX_MAX_PAGE_SIZE = 1000
+NETBOX_VERSION = "4.2"
+
+MAC_FIELD = {'id': 1, 'name': "MAC Address", 'db_column_name': "_snipeit_mac_address_1", 'format': "MAC"}
+SERIAL_FIELD = {'id': 2, 'name': "Warranty Note", 'db_column_name': "_snipeit_warranty_note_2", 'format': "ANY"}
+
+
+def snipe_dataset(assets: int, seed: int = 1):
+    """
+    A synthetic Snipe-IT inventory, the number of the other objects grows with the number of assets.
+    Every tenth asset name is used twice, about a third of the models have no MAC fieldset.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+
+    def changed(i: int):
+        value = (start + timedelta(minutes=i * 7 + rng.randrange(60))).strftime("%Y-%m-%d %H:%M:%S")
+        return {'datetime': value, 'formatted': value}
+
+    def ref(item):
+        return {'id': item['id'], 'name': item['name']}
+
+    companies = [{'id': i, 'name': "Company {}".format(i), 'updated_at': changed(i)} for i in range(1, 11 + assets // 5000)]
+    fieldsets = [{'id': 1, 'name': "Network", 'fields': {'total': 2, 'rows': [MAC_FIELD, SERIAL_FIELD]}},
+                 {'id': 2, 'name': "Warranty", 'fields': {'total': 1, 'rows': [SERIAL_FIELD]}}]
+    manufacturers = [{'id': i, 'name': "Manufacturer {}".format(i)} for i in range(1, 21)]
+    categories = [{'id': i, 'name': "Category {} - Hardware".format(i)} for i in range(1, 16)]
+    models = [{'id': i, 'name': "Model {}".format(i), 'model_number': "MN-{:05d}".format(i) if i % 4 else None,
+               'notes': "Model &amp; notes {}".format(i), 'manufacturer': ref(manufacturers[i % len(manufacturers)]),
+               'category': ref(categories[i % len(categories)]),
+               'fieldset': ref(fieldsets[0]) if i % 3 else (ref(fieldsets[1]) if i % 2 else None),
+               'updated_at': changed(i)}
+              for i in range(1, 51 + assets // 200)]
+
+    # a few top locations (the Sites) with two levels of Locations below
+    locations = []
+    for i in range(1, 6 + assets // 10000):
+        locations.append({'id': len(locations) + 1, 'name': "Site {}".format(i), 'parent': None})
+    for parent in list(locations):
+        for j in range(1, 5 + assets // 2000):
+            locations.append({'id': len(locations) + 1, 'name': "{} Building {}".format(parent['name'], j), 'parent': ref(parent)})
+    for parent in [location for location in locations if location['parent'] is not None]:
+        for j in range(1, 4):
+            locations.append({'id': len(locations) + 1, 'name': "Room {}".format(j), 'parent': ref(parent)})
+
+    statuses = [{'id': 1, 'name': "Deployed", 'status_meta': "deployed"},
+                {'id': 2, 'name': "Ready to Deploy", 'status_meta': "deployable"},
+                {'id': 3, 'name': "Pending", 'status_meta': "pending"}]
+
+    hardware = []
+    for i in range(1, assets + 1):
+        model = models[i % len(models)]
+        location = ref(locations[i % len(locations)]) if i % 7 else None
+        custom_fields = {}
+        if model['fieldset'] is not None and model['fieldset']['id'] == 1:
+            custom_fields[MAC_FIELD['name']] = {'field': MAC_FIELD['db_column_name'], 'field_format': "MAC",
+                                                'value': "02:00:{:02x}:{:02x}:{:02x}:{:02x}".format(*(i >> shift & 0xff for shift in (24, 16, 8, 0)))}
+        custom_fields[SERIAL_FIELD['name']] = {'field': SERIAL_FIELD['db_column_name'], 'field_format': "ANY", 'value': ""}
+        hardware.append({'id': i, 'name': "Asset {}".format(i - 1 if i % 10 == 0 else i), 'asset_tag': "T{:06d}".format(i),
+                         'serial': "SN{:08d}".format(rng.randrange(10 ** 8)), 'notes': "Notes for asset {}".format(i) if i % 2 else "",
+                         'model': ref(model), 'category': ref(categories[i % len(categories)]),
+                         'company': ref(companies[i % len(companies)]) if i % 11 else None,
+                         'status_label': statuses[i % len(statuses)],
+                         'assigned_to': dict(ref(locations[i % len(locations)]), type="location") if i % 5 == 0 else None,
+                         'location': location, 'rtd_location': location,
+                         'custom_fields': custom_fields, 'updated_at': changed(i)})
+
+    return {'hardware': hardware, 'models': models, 'fieldsets': fieldsets, 'locations': locations, 'companies': companies}
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.received = 0
+        self.sent = 0
+
+    def record(self, received: int, sent: int):
+        with self.lock:
+            self.requests += 1
+            self.received += received
+            self.sent += sent
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'requests': self.requests, 'received': self.received, 'sent': self.sent}
+
+
+class SnipeApi:
+    """
+    Read-only Snipe-IT API v1 over a fixed dataset: paged lists with limit, offset, sort=updated_at and order,
+    hardware can be filtered by model_id. The dataset has no deleted assets (status=Deleted).
+    """
+
+    def __init__(self, dataset: dict):
+        self.dataset = dataset
+        self.__sorted = {}
+        self.__by_model = {}
+        for asset in dataset['hardware']:
+            self.__by_model.setdefault(str(asset['model']['id']), []).append(asset)
+
+    def __rows(self, endpoint: str, params: dict):
+        rows = self.dataset[endpoint]
+        if params.get('status') == 'Deleted':
+            return []
+        if endpoint == 'hardware' and 'model_id' in params:
+            return self.__by_model.get(params['model_id'], [])
+        if params.get('sort') == 'updated_at':
+            order = params.get('order', 'asc')
+            if (endpoint, order) not in self.__sorted:
+                self.__sorted[(endpoint, order)] = sorted(rows, key=lambda row: row['updated_at']['datetime'], reverse=order == 'desc')
+            rows = self.__sorted[(endpoint, order)]
+        return rows
+
+    def handle(self, method: str, path: list, params: dict, body, base: str):
+        if method != 'GET' or len(path) != 3 or path[:2] != ['api', 'v1'] or path[2] not in self.dataset:
+            return 404, {'status': "error", 'messages': "404 endpoint not found"}
+
+        rows = self.__rows(path[2], params)
+        limit = min(int(params.get('limit') or 50), SNIPE_MAX_PAGE_SIZE)
+        offset = int(params.get('offset') or 0)
+        return 200, {'total': len(rows), 'rows': rows[offset:offset + limit]}
+
+
+class NetboxApi:
+    """
+    In-memory NetBox REST API for the object types written by the syncer. Supports the pynetbox calls used:
+    paginated and filtered lists, single and bulk creates and bulk updates. Bulk writes are atomic,
+    device names have to be unique per Site and Tenant like in NetBox.
+    """
+
+    ENDPOINTS = {
+        ('tenancy', 'tenants'): 'tenants',
+        ('dcim', 'manufacturers'): 'manufacturers',
+        ('dcim', 'device-types'): 'device_types',
+        ('dcim', 'device-roles'): 'device_roles',
+        ('dcim', 'sites'): 'sites',
+        ('dcim', 'locations'): 'locations',
+        ('dcim', 'devices'): 'devices',
+        ('dcim', 'interfaces'): 'interfaces',
+        ('dcim', 'mac-addresses'): 'mac_addresses',
+        ('extras', 'custom-fields'): 'custom_fields',
+    }
+    # fields referencing other objects, rendered as nested objects
+    RELATIONS = {
+        'device_types': {'manufacturer': 'manufacturers'},
+        'locations': {'site': 'sites', 'parent': 'locations'},
+        'devices': {'site': 'sites', 'location': 'locations', 'role': 'device_roles', 'tenant': 'tenants',
+                    'device_type': 'device_types'},
+        'interfaces': {'device': 'devices', 'primary_mac_address': 'mac_addresses'},
+        'mac_addresses': {'assigned_object_id': 'interfaces'},
+    }
+    STATUS = ('sites', 'locations', 'devices')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {kind: {} for kind in self.ENDPOINTS.values()}
+        self.__next_ids = {kind: 1 for kind in self.objects}
+        # device id per (name, site, tenant)
+        self.__device_names = {}
+
+    @staticmethod
+    def __now():
+        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def __url(self, base: str, kind: str, object_id: int):
+        app, name = next(key for key, value in self.ENDPOINTS.items() if value == kind)
+        return "{}/api/{}/{}/{}/".format(base, app, name, object_id)
+
+    def __nested(self, base: str, kind: str, object_id):
+        item = self.objects[kind].get(object_id)
+        if item is None:
+            return None
+        nested = {'id': object_id, 'url': self.__url(base, kind, object_id), 'display': item.get('name') or item.get('model')}
+        for field in ('name', 'slug', 'model', 'mac_address'):
+            if field in item:
+                nested[field] = item[field]
+        if kind == 'device_types':
+            nested['manufacturer'] = self.__nested(base, 'manufacturers', item['manufacturer'])
+        return nested
+
+    def __render(self, base: str, kind: str, item: dict):
+        rendered = dict(item, url=self.__url(base, kind, item['id']), display=item.get('name') or item.get('model'))
+        for field, related in self.RELATIONS.get(kind, {}).items():
+            if kind != 'mac_addresses':
+                rendered[field] = self.__nested(base, related, item.get(field))
+        if kind == 'interfaces':
+            # NetBox 4.2 shows the primary MAC address object as mac_address of the interface
+            primary = self.objects['mac_addresses'].get(item['primary_mac_address'])
+            rendered['mac_address'] = primary['mac_address'] if primary else None
+        if kind in self.STATUS:
+            rendered['status'] = {'value': item['status'], 'label': item['status'].title()}
+        return rendered
+
+    @staticmethod
+    def __project(rendered: dict, fields: str = None):
+        # the dynamic field selection of NetBox 4
+        if not fields:
+            return rendered
+        return {field: rendered[field] for field in fields.split(',') if field in rendered}
+
+    @staticmethod
+    def __matches(item: dict, params: dict):
+        for key, value in params.items():
+            if key in ('limit', 'offset', 'brief', 'ordering', 'fields'):
+                continue
+            if key.endswith('__gte'):
+                if str(item.get(key[:-5]) or "") < value:
+                    return False
+            elif key.startswith('cf_'):
+                if str(item['custom_fields'].get(key[3:])) != value:
+                    return False
+            elif str(item.get(key)) != value:
+                return False
+        return True
+
+    def __validate(self, kind: str, data: dict, current: dict = None):
+        errors = {}
+        merged = (current or {}) | data
+        for field, related in self.RELATIONS.get(kind, {}).items():
+            if merged.get(field) is not None and merged[field] not in self.objects[related]:
+                errors[field] = ["Related object not found using the provided numeric ID: {}".format(merged[field])]
+        if kind == 'devices' and merged.get('name'):
+            other = self.__device_names.get((merged['name'], merged.get('site'), merged.get('tenant')))
+            if other is not None and other != merged.get('id'):
+                errors['name'] = ["Device name must be unique per site and tenant."]
+        return errors
+
+    def __save(self, kind: str, data: dict, current: dict = None):
+        if current is None:
+            item = {'id': self.__next_ids[kind], 'name': None, 'comments': "", 'description': "", 'custom_fields': {},
+                    'created': self.__now()}
+            if kind in self.STATUS:
+                item['status'] = 'active'
+            for field in self.RELATIONS.get(kind, {}):
+                item[field] = None
+            if kind == 'devices':
+                item |= {'asset_tag': None, 'serial': ""}
+            self.__next_ids[kind] += 1
+        else:
+            item = current
+            if kind == 'devices':
+                self.__device_names.pop((item['name'], item['site'], item['tenant']), None)
+        for key, value in data.items():
+            if key == 'custom_fields':
+                item['custom_fields'] = item['custom_fields'] | value
+            elif key != 'id':
+                item[key] = value
+        item['last_updated'] = self.__now()
+        self.objects[kind][item['id']] = item
+        if kind == 'devices' and item['name']:
+            self.__device_names[(item['name'], item['site'], item['tenant'])] = item['id']
+        return item
+
+    def __list(self, base: str, kind: str, params: dict, path: str):
+        items = [item for item in self.objects[kind].values() if self.__matches(item, params)]
+        limit = int(params.get('limit') or NETBOX_PAGE_SIZE)
+        limit = NETBOX_MAX_PAGE_SIZE if limit == 0 else min(limit, NETBOX_MAX_PAGE_SIZE)
+        offset = int(params.get('offset') or 0)
+        following = None
+        if offset + limit < len(items):
+            following = "{}{}?{}".format(base, path, urlencode(params | {'limit': limit, 'offset': offset + limit}))
+        return {'count': len(items), 'next': following, 'previous': None,
+                'results': [self.__project(self.__render(base, kind, item), params.get('fields')) for item in items[offset:offset + limit]]}
+
+    def handle(self, method: str, path: list, params: dict, body, base: str):
+        if path in (['api'], ['api', 'status']):
+            return 200, {'netbox-version': NETBOX_VERSION + ".0"}
+        kind = self.ENDPOINTS.get(tuple(path[1:3])) if len(path) in (3, 4) and path[0] == 'api' else None
+        if kind is None:
+            return 404, {'detail': "Not found."}
+        object_id = int(path[3]) if len(path) == 4 else None
+
+        with self.lock:
+            if method == 'GET' and object_id is None:
+                return 200, self.__list(base, kind, params, "/" + "/".join(path) + "/")
+            if method == 'GET':
+                item = self.objects[kind].get(object_id)
+                return (200, self.__render(base, kind, item)) if item else (404, {'detail': "Not found."})
+
+            many = isinstance(body, list)
+            batch = body if many else [dict(body or {}, id=object_id) if object_id else body or {}]
+            if method == 'POST' and object_id is None:
+                currents = [None] * len(batch)
+            elif method == 'PATCH':
+                currents = [self.objects[kind].get(data.get('id')) for data in batch]
+                if any(current is None for current in currents):
+                    return 400, {'detail': "Object not found."}
+            else:
+                return 405, {'detail': "Method \"{}\" not allowed.".format(method)}
+
+            errors = [self.__validate(kind, data, current) for data, current in zip(batch, currents)]
+            if any(errors):
+                return 400, errors if many else errors[0]
+            saved = [self.__render(base, kind, self.__save(kind, data, current)) for data, current in zip(batch, currents)]
+            return (201 if method == 'POST' else 200), saved if many else saved[0]
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api, latency: float = 0.0, port: int = 0, throttle: int = 0):
+        """
+        :param throttle: requests per second answered before responding 429 with a Retry-After, 0 for no limit
+        """
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.api = api
+        self.latency = latency
+        self.throttle = throttle
+        self.stats = Stats()
+        self.lock = threading.Lock()
+        self.__window = (0, 0)
+
+    def throttled(self) -> bool:
+        if not self.throttle:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window, count = self.__window
+            count = count + 1 if window == second else 1
+            self.__window = (second, count)
+            return count > self.throttle
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-{}".format(type(self.api).__name__), daemon=True).start()
+        return self
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def __handle(self, method: str):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b""
+
+        headers = {}
+        if url.path == '/_stats':
+            status, payload = 200, self.server.stats.snapshot()
+        elif self.server.throttled():
+            status, payload = 429, {'status': "error", 'messages': "Too Many Requests"}
+            headers['Retry-After'] = "1"
+        else:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            path = [part for part in url.path.split('/') if part]
+            status, payload = self.server.api.handle(method, path, dict(parse_qsl(url.query)), json.loads(body) if body else None,
+                                                     "http://{}".format(self.headers.get('Host')))
+
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if isinstance(self.server.api, NetboxApi):
+            self.send_header('API-Version', NETBOX_VERSION)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if url.path != '/_stats':
+            self.server.stats.record(len(self.requestline) + len(body), len(data))
+
+    def do_GET(self):
+        self.__handle('GET')
+
+    def do_POST(self):
+        self.__handle('POST')
+
+    def do_PATCH(self):
+        self.__handle('PATCH')
+
+    def do_PUT(self):
+        self.__handle('PUT')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, default=1000, help="number of assets in the Snipe-IT inventory")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--snipe-port', type=int, default=0)
+    parser.add_argument('--netbox-port', type=int, default=0)
+    parser.add_argument('--throttle', type=int, default=0, help="requests per second each server answers before responding 429")
+    args = parser.parse_args()
+
+    snipe_server = MockServer(SnipeApi(snipe_dataset(args.assets, args.seed)), args.latency, args.snipe_port, args.throttle).start()
+    netbox_server = MockServer(NetboxApi(), args.latency, args.netbox_port, args.throttle).start()
+    print("{} {}".format(snipe_server.url, netbox_server.url), flush=True)
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
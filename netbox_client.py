@@ -0,0 +1,134 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pynetbox
+
+import governor
+from pooling import pooled_session, prefetch
+
+
+class NetboxClient:
+    """
+    NetBox REST client with a pooled keep-alive session, a drop-in for the parts of pynetbox.api the syncer uses:
+    netbox.<app>.<endpoint> with all/filter/get/count/create/update, http_session, base_url, token and version.
+    The pages of a list are fetched concurrently and at most `concurrency` writes are in flight across all threads.
+    Objects are returned as dicts, failed requests raise pynetbox.RequestError like pynetbox does.
+    """
+
+    def __init__(self, url: str, token: str, concurrency: int = 4, page_size: int = 1000,
+                 request_governor: governor.Governor = None):
+        self.base_url = "{}/api".format(url if url[-1] != "/" else url[:-1])
+        self.token = token
+        self.concurrency = max(1, concurrency)
+        self.page_size = page_size
+
+        self.http_session = pooled_session(self.concurrency, {'Authorization': "Token {}".format(token),
+                                                              'accept': 'application/json',
+                                                              'content-type': 'application/json'}, request_governor)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="netbox")
+        self.__writes = threading.BoundedSemaphore(self.concurrency)
+        self.__version = None
+
+    def __getattr__(self, app: str):
+        if app.startswith('_'):
+            raise AttributeError(app)
+        return App(self, app)
+
+    @property
+    def version(self) -> str:
+        """
+        The API version of NetBox, e.g. '4.2', empty if the server does not send it
+        """
+        if self.__version is None:
+            response = self.request('GET', self.base_url + "/")
+            self.__version = response.headers.get('API-Version', "")
+        return self.__version
+
+    def request(self, method: str, url: str, params: dict = None, json=None):
+        if method == 'GET':
+            response = self.http_session.get(url, params=params)
+        else:
+            with self.__writes:
+                response = self.http_session.request(method, url, params=params, json=json)
+        if not response.ok:
+            raise pynetbox.RequestError(response)
+        return response
+
+    def get_json(self, url: str, params: dict = None):
+        return self.request('GET', url, params).json()
+
+    def pages(self, url: str, params: dict = None):
+        """
+        Yields the objects of a list in order. The first page tells the total, the others are fetched concurrently
+        by offset.
+        """
+        params = dict(params or {})
+        params.setdefault('limit', self.page_size)
+        first = self.get_json(url, params | {'offset': 0})
+        yield from first['results']
+        if not first.get('next') or not first['results']:
+            return
+
+        # NetBox caps the page size at MAX_PAGE_SIZE, the first page shows the effective one
+        limit = len(first['results'])
+        for page in prefetch(self.executor, self.get_json, ((url, params | {'limit': limit, 'offset': offset})
+                                                            for offset in range(limit, first['count'], limit)), self.concurrency):
+            yield from page['results']
+
+
+class App:
+    def __init__(self, client: NetboxClient, name: str):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return Endpoint(self.client, self.name, name)
+
+
+class Endpoint:
+    """
+    The operations of a pynetbox endpoint used by the syncer, e.g. netbox.dcim.devices
+    """
+
+    def __init__(self, client: NetboxClient, app: str, name: str):
+        self.client = client
+        self.url = "{}/{}/{}/".format(client.base_url, app, name.replace('_', '-'))
+
+    def all(self):
+        return self.client.pages(self.url)
+
+    def filter(self, **params):
+        return self.client.pages(self.url, params)
+
+    def get(self, object_id: int = None, **params):
+        """
+        The object with the given id or the only one matching the filter, None if there is none
+        """
+        if object_id is not None:
+            try:
+                return self.client.get_json("{}{}/".format(self.url, object_id))
+            except pynetbox.RequestError as e:
+                if e.req.status_code == 404:
+                    return None
+                raise
+        found = self.client.get_json(self.url, params | {'limit': 2})
+        if found['count'] > 1:
+            raise ValueError("get() returned more than one result, use filter() or all()")
+        return found['results'][0] if found['results'] else None
+
+    def count(self, **params) -> int:
+        return self.client.get_json(self.url, params | {'brief': 1, 'limit': 1})['count']
+
+    def create(self, data):
+        """
+        :param data: one object or a list of objects, created in one atomic request
+        """
+        return self.client.request('POST', self.url, json=data).json()
+
+    def update(self, objects: list):
+        """
+        :param objects: the changed fields with the id of each object, updated in one atomic request
+        """
+        return self.client.request('PATCH', self.url, json=objects).json()
@@ -0,0 +1,127 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+from writer import BulkWriter
+
+# fields referencing other NetBox objects, they may hold the placeholder id of a planned object
+RELATIONS = ('manufacturer', 'site', 'parent', 'location', 'tenant', 'role', 'device_type', 'device', 'assigned_object_id',
+             'primary_mac_address')
+
+
+class PlanWriter(BulkWriter):
+    """
+    Stands in for the BulkWriter in a dry run: the creates and updates of the syncer are recorded as change set
+    instead of being sent. Created objects get negative placeholder ids, so later changes can reference them,
+    and the skipped changes are kept as conflicts. Nothing is written to NetBox.
+    """
+
+    def __init__(self, endpoints: dict, batch_size: int = 100):
+        super().__init__(None, endpoints, batch_size)
+        self.changes = []
+        self.conflicts = []
+        self.__next_placeholder = -1
+
+    @staticmethod
+    def __planned(data: dict, object_id: int):
+        """
+        The object as NetBox would return it, as far as it is known
+        """
+        record = dict(data, id=object_id, last_updated=None)
+        for field in RELATIONS:
+            if isinstance(record.get(field), int):
+                record[field] = {'id': record[field], 'name': None}
+        if isinstance(record.get('status'), str):
+            record['status'] = {'value': record['status']}
+        return record
+
+    def __record(self, kind: str, method: str, data: dict, source) -> int:
+        with self.lock:
+            if method == 'create':
+                object_id = self.__next_placeholder
+                self.__next_placeholder -= 1
+                data = dict(data, id=object_id)
+                self.counts[(kind, 'created')] += 1
+            else:
+                object_id = data['id']
+                self.counts[(kind, 'updated')] += 1
+            action = 'link' if method == 'update' and 'custom_fields' in data else method
+            self.changes.append({'kind': kind, 'action': action, 'source': None if source is None else str(source), 'data': data})
+        return object_id
+
+    def create(self, kind: str, data: dict, source=None, callback=None):
+        object_id = self.__record(kind, 'create', data, source)
+        if callback is not None:
+            callback(self.__planned(data, object_id))
+
+    def update(self, kind: str, data: dict, source=None, callback=None):
+        object_id = self.__record(kind, 'update', data, source)
+        if callback is not None:
+            callback(self.__planned(data, object_id))
+
+    def create_now(self, kind: str, data: dict):
+        object_id = self.__record(kind, 'create', data, None)
+        return self.__planned(data, object_id)
+
+    def flush(self, kind: str = None):
+        pass
+
+    def skipped(self, kind: str, source=None, reason: str = None):
+        if reason is not None:
+            with self.lock:
+                self.conflicts.append({'kind': kind, 'source': None if source is None else str(source), 'reason': reason})
+        super().skipped(kind, source, reason)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {'created': datetime.now(timezone.utc).isoformat(),
+                    'changes': list(self.changes), 'conflicts': list(self.conflicts),
+                    'failures': [{'kind': kind, 'action': method, 'source': str(source), 'error': str(error)}
+                                 for kind, method, source, error in self.failures]}
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1, default=str)
+        logging.info("Wrote plan with {} changes and {} conflicts to {}".format(len(self.changes), len(self.conflicts), path))
+
+
+def apply_plan(writer: BulkWriter, plan: dict):
+    """
+    Sends the changes of a plan in bulk, in their planned order. Placeholder ids are replaced by the ids of the
+    created objects, pending batches are sent as soon as a change references an object not created yet.
+    Changes depending on a failed create fail as well.
+    """
+    ids = {}
+
+    def resolve(data: dict):
+        resolved = dict(data)
+        for field in RELATIONS + ('id',):
+            value = resolved.get(field)
+            if isinstance(value, int) and value < 0:
+                if value not in ids:
+                    return None
+                resolved[field] = ids[value]
+        return resolved
+
+    def created(placeholder: int):
+        return lambda record: ids.__setitem__(placeholder, record['id'])
+
+    for change in plan['changes']:
+        kind, action, source = change['kind'], change['action'], change['source']
+        data = dict(change['data'])
+        placeholder = data.pop('id') if action == 'create' else None
+
+        resolved = resolve(data)
+        if resolved is None:
+            writer.flush()
+            resolved = resolve(data)
+        if resolved is None:
+            writer.failed(kind, action, source, "depends on an object which could not be created")
+            continue
+
+        if action == 'create':
+            writer.create(kind, resolved, source, created(placeholder))
+        else:
+            writer.update(kind, resolved, source)
+
+    writer.flush()
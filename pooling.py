@@ -0,0 +1,44 @@
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import governor
+
+
+def pooled_session(concurrency: int, headers: dict, request_governor: governor.Governor = None) -> requests.Session:
+    """
+    One keep-alive session with a connection per concurrent request. Failed reads (5xx) are retried with backoff,
+    writes are not idempotent. Throttled requests (429/503) are retried too, by the governor if there is one,
+    which then slows down all requests to the service.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    if request_governor is not None:
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 504], allowed_methods=['GET'])
+        governor.mount(session, request_governor, pool_connections=1, pool_maxsize=concurrency, max_retries=retries)
+    else:
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    return session
+
+
+def prefetch(executor, func, arguments, window: int):
+    """
+    Calls func for each argument on the executor and yields the results in argument order.
+    At most `window` calls are in flight, so a slow consumer does not pile up fetched pages.
+    """
+    pending = deque()
+    try:
+        for argument in arguments:
+            pending.append(executor.submit(func, *argument))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
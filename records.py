@@ -0,0 +1,187 @@
+import pynetbox
+
+
+class Record:
+    """
+    Compact object holding only the fields the syncer reads, in __slots__ instead of a dict per object.
+    Fields are read like on dicts and pynetbox records (record['name']), dict(record) serializes it including
+    nested objects.
+    """
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __iter__(self):
+        for field in self.__slots__:
+            value = getattr(self, field)
+            yield field, dict(value) if isinstance(value, Record) else value
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, dict(self))
+
+
+class Ref(Record):
+    """
+    A nested object, e.g. the Site of a Device
+    """
+    __slots__ = ('id', 'name')
+
+
+class Choice(Record):
+    """
+    A choice field, e.g. the status of a Device
+    """
+    __slots__ = ('value',)
+
+
+class StatusLabel(Record):
+    __slots__ = ('id', 'name', 'status_meta')
+
+
+class Assignee(Record):
+    """
+    The user, location or asset an asset is checked out to
+    """
+    __slots__ = ('id', 'name', 'type')
+
+
+class SnipeAsset(Record):
+    """
+    Compact Snipe-IT asset with the attributes the syncer reads. Nested objects repeated across many assets,
+    like categories, companies, models and locations, are shared instances, see shared().
+    """
+    __slots__ = ('id', 'name', 'asset_tag', 'serial', 'notes', 'model', 'category', 'company', 'status_label',
+                 'assigned_to', 'location', 'rtd_location', 'macs')
+
+    @classmethod
+    def from_row(cls, row: dict, refs: dict, macs=()):
+        """
+        :param refs: the shared nested objects, kept by the caller for all pages
+        :param macs: (name, value) of the MAC custom fields
+        """
+        return cls(id=row['id'], name=row['name'], asset_tag=row['asset_tag'], serial=row['serial'], notes=row['notes'],
+                   model=shared(refs, Ref, row['model']), category=shared(refs, Ref, row['category']),
+                   company=shared(refs, Ref, row['company']), status_label=shared(refs, StatusLabel, row['status_label']),
+                   assigned_to=shared(refs, Assignee, row['assigned_to']), location=shared(refs, Ref, row['location']),
+                   rtd_location=shared(refs, Ref, row['rtd_location']),
+                   macs=tuple((name, value) for name, value in macs))
+
+
+def shared(refs: dict, ref_type, data: dict):
+    """
+    One instance per distinct nested object, looked up in and added to refs
+    """
+    if data is None:
+        return None
+    values = tuple(data.get(field) for field in ref_type.__slots__)
+    ref = refs.get((ref_type, values))
+    if ref is None:
+        ref = refs.setdefault((ref_type, values), ref_type(**dict(zip(ref_type.__slots__, values))))
+    return ref
+
+
+def nested(value):
+    if not isinstance(value, dict):
+        return value
+    if 'id' not in value and 'value' in value:
+        return Choice(value=value['value'])
+    return Ref(id=value.get('id'), name=value.get('name') or value.get('model'))
+
+
+class NetboxReader:
+    """
+    Reads NetBox objects as compact records. Only the given fields are requested (NetBox 4 `fields` parameter),
+    older versions ignore it and send everything, the records keep the requested fields either way.
+    Custom fields are reduced to the given ones. Works with pynetbox.api and the pooled NetboxClient.
+    """
+
+    def __init__(self, netbox, endpoints: dict, fields: dict, custom_fields=(), page_size: int = 1000):
+        """
+        :param endpoints: object type -> pynetbox (app, endpoint) name
+        :param fields: object type -> names of the fields read
+        """
+        self.netbox = netbox
+        self.endpoints = endpoints
+        self.custom_fields = tuple(custom_fields)
+        self.page_size = page_size
+        self.types = {kind: type("{}Record".format(kind.title().replace('_', '')), (Record,), {'__slots__': tuple(names)})
+                      for kind, names in fields.items()}
+
+    def endpoint(self, kind: str):
+        return RecordEndpoint(self, kind)
+
+    def record(self, kind: str, item) -> Record:
+        """
+        The compact record of a NetBox object given as dict or pynetbox record
+        """
+        data = item if isinstance(item, dict) else dict(item)
+        record_type = self.types[kind]
+        values = {field: nested(data.get(field)) for field in record_type.__slots__}
+        if 'custom_fields' in values:
+            custom_fields = data.get('custom_fields') or {}
+            values['custom_fields'] = {name: custom_fields.get(name) for name in self.custom_fields}
+        return record_type(**values)
+
+    def __get(self, url: str, params: dict = None):
+        response = self.netbox.http_session.get(url, params=params, headers={'accept': 'application/json',
+                                                                             'authorization': "Token {}".format(self.netbox.token)})
+        if not response.ok:
+            raise pynetbox.RequestError(response)
+        return response.json()
+
+    def __url(self, kind: str):
+        app, name = self.endpoints[kind]
+        return "{}/{}/{}/".format(self.netbox.base_url, app, name.replace('_', '-'))
+
+    def list(self, kind: str, params: dict = None):
+        """
+        Yields the records of the objects matching the filter params, following the pagination of NetBox
+        """
+        params = (params or {}) | {'fields': ",".join(self.types[kind].__slots__), 'limit': self.page_size}
+        pages = getattr(self.netbox, 'pages', None)
+        if pages is not None:
+            # the pooled client fetches the pages concurrently
+            for item in pages(self.__url(kind), params):
+                yield self.record(kind, item)
+            return
+
+        response = self.__get(self.__url(kind), params)
+        while True:
+            for item in response['results']:
+                yield self.record(kind, item)
+            if not response.get('next'):
+                break
+            response = self.__get(response['next'])
+
+    def count(self, kind: str, params: dict = None) -> int:
+        return self.__get(self.__url(kind), (params or {}) | {'brief': 1, 'limit': 1})['count']
+
+
+class RecordEndpoint:
+    """
+    The read methods of a pynetbox endpoint, returning compact records
+    """
+
+    def __init__(self, reader: NetboxReader, kind: str):
+        self.reader = reader
+        self.kind = kind
+
+    def all(self):
+        return self.reader.list(self.kind)
+
+    def filter(self, **params):
+        return self.reader.list(self.kind, params)
+
+    def count(self, **params):
+        return self.reader.count(self.kind, params)
@@ -0,0 +1,71 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from checkpoint import Checkpoint
+
+
+class PhaseScheduler:
+    """
+    Runs named phases on a thread pool, each one as soon as all phases it depends on are done.
+    A phase is called with the dict of the results of the finished phases.
+    With a checkpoint, completed phases are recorded and the ones completed by an interrupted run are skipped.
+    """
+
+    def __init__(self, workers: int = 4, checkpoint: Checkpoint = None):
+        self.workers = max(1, workers)
+        self.checkpoint = checkpoint
+        # seconds per finished phase
+        self.durations = {}
+        self.__phases = {}
+
+    def add(self, name: str, func, after=(), encode=None, decode=None):
+        """
+        :param encode: converts the result into JSON for the checkpoint, decode converts it back
+        """
+        self.__phases[name] = (func, tuple(after), encode, decode)
+
+    def __run(self, name: str, func, results: dict, encode, decode):
+        if self.checkpoint is not None and self.checkpoint.done(name):
+            logging.info("Skipping phase {}, it was completed before".format(name))
+            result = self.checkpoint.result(name)
+            return decode(result) if decode is not None else result
+
+        logging.info("Starting phase {}".format(name))
+        start = time.perf_counter()
+        result = func(results)
+        self.durations[name] = time.perf_counter() - start
+        logging.info("Finished phase {} in {:.1f}s".format(name, self.durations[name]))
+        if self.checkpoint is not None:
+            self.checkpoint.complete(name, encode(result) if encode is not None else result)
+        return result
+
+    def run(self) -> dict:
+        for name, (_, after, _, _) in self.__phases.items():
+            missing = [dependency for dependency in after if dependency not in self.__phases]
+            if missing:
+                raise ValueError("phase {} depends on unknown phases {}".format(name, missing))
+
+        results = {}
+        pending = dict(self.__phases)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="phase") as executor:
+            try:
+                while pending or running:
+                    for name, (func, after, encode, decode) in list(pending.items()):
+                        if all(dependency in results for dependency in after):
+                            running[executor.submit(self.__run, name, func, results, encode, decode)] = name
+                            del pending[name]
+
+                    if not running:
+                        raise ValueError("circular dependency between phases {}".format(list(pending)))
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[running.pop(future)] = future.result()
+            finally:
+                for future in running:
+                    future.cancel()
+
+        return results
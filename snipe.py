@@ -1,27 +1,117 @@
 import logging
 import math
-import requests
+from concurrent.futures import ThreadPoolExecutor
+
 from w3lib.html import replace_entities
 
+import governor
+from pooling import pooled_session, prefetch
+from records import SnipeAsset
+
+
+def unique_by_id(items):
+    """
+    Yields the given Snipe objects, skipping repeated ones with an already seen id
+    """
+    seen = set()
+    for item in items:
+        if item['id'] not in seen:
+            seen.add(item['id'])
+            yield item
+
+
+def updated_at(item):
+    """
+    The time of the last change of a Snipe object as sortable 'Y-m-d H:i:s' string
+    """
+    value = item.get('updated_at')
+    return value['datetime'] if value else None
+
+
 class Snipe:
-    def __init__(self, url: str, token: str):
+    def __init__(self, url: str, token: str, concurrency: int = 4, request_governor: governor.Governor = None):
         self.url = "{}/api/v1/".format(url if url[-1] != "/" else url[:-1])
         self.token = token
         self.headers = {'Authorization': 'Bearer ' + token,
                         'accept': 'application/json',
                         'content-type': 'application/json'}
-
-
-    def __get_paged_items(self, session: requests.Session, endpoint: str, pagesize: int = 100):
-        response = session.get(self.url + endpoint, params={'limit': pagesize, 'offset': 0},
-                               headers=self.headers).json()
+        self.concurrency = max(1, concurrency)
+
+        # one pooled session for all requests
+        self.session = pooled_session(self.concurrency, self.headers, request_governor)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="snipe")
+
+        # newest change seen per endpoint, the high-water mark for the next incremental run
+        self.watermarks = {}
+        # ids of all models with a MAC fieldset, known after get_models_and_manufacturers_with_mac()
+        self.mac_model_ids = set()
+        # nested objects shared by the compact assets
+        self.refs = {}
+        # ids of the changed assets without MAC fields seen by the last iter_assets_with_mac(), e.g. moved to another model
+        self.assets_without_mac = set()
+
+
+    def __get(self, endpoint: str, params: dict = None):
+        response = self.session.get(self.url + endpoint, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def __fetch_pages(self, page_requests):
+        """
+        Fetches the given (endpoint, params) requests concurrently and yields the responses in request order
+        """
+        return prefetch(self.executor, self.__get, page_requests, self.concurrency)
+
+    def __get_paged_items(self, endpoint: str, pagesize: int = 100, params: dict = None):
+        params = params or {}
+        response = self.__get(endpoint, params | {'limit': pagesize, 'offset': 0})
         yield response
         num_pages = math.ceil(response['total'] / pagesize)
 
-        for page in range(1, num_pages):
-            next_page = session.get(self.url + endpoint, params={'limit': pagesize, 'offset': page * pagesize},
-                                    headers=self.headers).json()
-            yield next_page
+        yield from self.__fetch_pages((endpoint, params | {'limit': pagesize, 'offset': page * pagesize})
+                                      for page in range(1, num_pages))
+
+    def __get_pages_by_model(self, endpoint: str, model_ids: list, pagesize: int = 100):
+        """
+        Fetches the pages of the given models only, the first pages of all models concurrently, then the remaining ones
+        """
+        totals = {}
+        first_pages = self.__fetch_pages((endpoint, {'model_id': model_id, 'limit': pagesize, 'offset': 0}) for model_id in model_ids)
+        for model_id, page in zip(model_ids, first_pages):
+            yield page
+            totals[model_id] = page['total']
+
+        yield from self.__fetch_pages((endpoint, {'model_id': model_id, 'limit': pagesize, 'offset': page * pagesize})
+                                      for model_id, total in totals.items() for page in range(1, math.ceil(total / pagesize)))
+
+    def __get_changed_pages(self, endpoint: str, since: str, pagesize: int = 100, params: dict = None):
+        """
+        Fetches the pages sorted by the newest change first and stops after the first page reaching objects
+        older than the watermark. If Snipe does not honor the sort order, all pages are fetched.
+        """
+        previous = None
+        ordered = True
+        for page in self.__get_paged_items(endpoint, pagesize, (params or {}) | {'sort': 'updated_at', 'order': 'desc'}):
+            yield page
+            for row in page['rows']:
+                changed = updated_at(row)
+                if changed is not None:
+                    if previous is not None and changed > previous:
+                        ordered = False
+                    previous = changed
+            if ordered and previous is not None and previous < since:
+                break
+
+    def __changed(self, endpoint: str, items, since: str = None):
+        """
+        Filters the objects changed since the watermark (all if None) and tracks the newest change per endpoint
+        """
+        for item in items:
+            changed = updated_at(item)
+            if changed is not None and changed > self.watermarks.get(endpoint, ""):
+                self.watermarks[endpoint] = changed
+            if since is None or changed is None or changed >= since:
+                yield item
 
     @staticmethod
     def __custom_fields_has_mac_type(custom_fields: dict):
@@ -32,73 +122,94 @@ class Snipe:
 
 
     def get_locations(self):
-        session = requests.Session()
-
-        locations = []
-        for page in self.__get_paged_items(session, "locations", pagesize=200):
-            for location in page['rows']:
-                if location not in locations:
-                    locations.append(location)
+        locations = list(unique_by_id(location for page in self.__get_paged_items("locations", pagesize=200)
+                                      for location in page['rows']))
 
         locations = sorted(locations, key=lambda d: d['name'])
         return locations
 
-    def get_assets_with_mac(self):
-        session = requests.Session()
-
-        # i don't know an easy way to fetch only assets with mac fieldsets, so we have to get everything and filter locally
-
-        assets = []
-        for page in self.__get_paged_items(session, "hardware", pagesize=200):
+    def iter_assets_with_mac(self, since: str = None, model_ids=None):
+        """
+        Yields the assets with MAC fields as compact SnipeAsset records, page by page while the following pages are
+        still being fetched
+        :param since: only yield assets changed since this watermark
+        :param model_ids: the models with a MAC fieldset, only their assets are fetched. Without them all assets are
+                          fetched and filtered locally. In incremental mode the changed assets of all models are fetched
+                          in one query sorted by the last change, which is less than a query per model.
+        """
+        if since is not None:
+            pages = self.__get_changed_pages("hardware", since, pagesize=200)
+        elif model_ids is not None:
+            pages = self.__get_pages_by_model("hardware", sorted(model_ids), pagesize=200)
+        else:
+            pages = self.__get_paged_items("hardware", pagesize=200)
+
+        seen = set()
+        self.assets_without_mac = set()
+        for page in pages:
             print("Page {}".format(len(page['rows'])))
-            for asset in page['rows']:
-                if Snipe.__custom_fields_has_mac_type(asset['custom_fields']):
-                    if asset not in assets:
-                        for att in ['name', 'notes']:
-                            if asset[att]: asset[att] = replace_entities(asset[att])
-                        assets.append(asset)
-
+            for asset in self.__changed("hardware", page['rows'], since):
+                if not Snipe.__custom_fields_has_mac_type(asset['custom_fields']):
+                    self.assets_without_mac.add(asset['id'])
+                elif asset['id'] not in seen:
+                    seen.add(asset['id'])
+                    for att in ['name', 'notes']:
+                        if asset[att]: asset[att] = replace_entities(asset[att])
+                    macs = [(name, field['value']) for name, field in asset['custom_fields'].items()
+                            if field['field_format'].lower() == "mac" and field['value']]
+                    yield SnipeAsset.from_row(asset, self.refs, macs)
+
+    def get_assets_with_mac(self, since: str = None, model_ids=None):
+        assets = list(self.iter_assets_with_mac(since, model_ids))
         #assets = sorted(assets, key=lambda d: d['asset_tag'])
         return assets
 
-    def get_models_and_manufacturers_with_mac(self):
-        session = requests.Session()
-
-        fieldsets = self.__get_fieldsets_with_mac(session)
-
-        manufacturers = []
-        models = []
-
-        for page in self.__get_paged_items(session, "models"):
-            for model in page['rows']:
+    def get_deleted_asset_ids(self, since: str) -> set:
+        """
+        Ids of the assets deleted since the watermark, deleting an asset in Snipe changes its updated_at
+        """
+        return {asset['id'] for page in self.__get_changed_pages("hardware", since, 200, {'status': 'Deleted'})
+                for asset in page['rows'] if updated_at(asset) is None or updated_at(asset) >= since}
+
+    def get_models_and_manufacturers_with_mac(self, since: str = None):
+        """
+        :param since: only return models changed since this watermark and their manufacturers
+        """
+        fieldsets = self.__get_fieldsets_with_mac()
+
+        manufacturers = {}
+        models = {}
+
+        for page in self.__get_paged_items("models"):
+            self.mac_model_ids.update(model['id'] for model in page['rows']
+                                      if model['fieldset'] is not None and model['fieldset']['id'] in fieldsets)
+            for model in self.__changed("models", page['rows'], since):
                 if model['fieldset'] is not None and model['fieldset']['id'] in fieldsets:
 
-                    if model not in models:
+                    if model['id'] not in models:
                         for att in ['name', 'notes']:
                             if model[att]: model[att] = replace_entities(model[att])
-                        models.append(model)
+                        models[model['id']] = model
 
-                    if model['manufacturer'] not in manufacturers:
-                        manufacturers.append(model['manufacturer'])
+                    manufacturers.setdefault(model['manufacturer']['id'], model['manufacturer'])
 
-        manufacturers = sorted(manufacturers, key=lambda d: d['id'])
-        models = sorted(models, key=lambda d: d['id'])
+        manufacturers = sorted(manufacturers.values(), key=lambda d: d['id'])
+        models = sorted(models.values(), key=lambda d: d['id'])
 
 
         return manufacturers, models
 
-    def __get_fieldsets_with_mac(self, session: requests.Session):
-        response = session.get(self.url + "fieldsets", headers=self.headers).json()
-        fieldsets_with_mac = []
+    def __get_fieldsets_with_mac(self):
+        response = self.__get("fieldsets")
+        fieldsets_with_mac = set()
 
         for fieldset in response['rows']:
             for fields in fieldset['fields']['rows']:
                 if str(fields['format']).lower() == "mac":
-                    fieldsets_with_mac.append(fieldset['id'])
+                    fieldsets_with_mac.add(fieldset['id'])
                     break
 
         return fieldsets_with_mac
 
-    def get_companies(self):
-        session = requests.Session()
-        return session.get(self.url + "companies", headers=self.headers).json()['rows']
+    def get_companies(self, since: str = None):
+        return list(self.__changed("companies", self.__get("companies")['rows'], since))
@@ -0,0 +1,44 @@
+import json
+import sqlite3
+import threading
+
+
+class StateStore:
+    """
+    Small key/value store in a local SQLite file, keeping state between sync runs.
+    Values are stored as JSON and grouped by namespace.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS state (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+                            "PRIMARY KEY (namespace, key))")
+
+    def get(self, namespace: str, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, str(key))).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set(self, namespace: str, key, value):
+        self.set_many(namespace, {key: value})
+
+    def set_many(self, namespace: str, values: dict):
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                                ((namespace, str(key), json.dumps(value, default=str)) for key, value in values.items()))
+
+    def items(self, namespace: str) -> dict:
+        with self.lock:
+            rows = self.db.execute("SELECT key, value FROM state WHERE namespace = ?", (namespace,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def delete(self, namespace: str, key):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+
+    def clear(self, namespace: str):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
@@ -1,22 +1,137 @@
 import datetime
+import hashlib
+import json
 import logging
+import queue
+import threading
 import unicodedata
 import re
+from collections import Counter
 from datetime import datetime, timezone
 
 import pynetbox
 
+from cache import NetboxCache
+from index import ObjectIndex, normalize
+from records import NetboxReader, Record
+from state import StateStore
+from writer import BulkWriter
+
 KEY_CUSTOM_FIELD = "snipe_object_id"
 DEFAULT_SITE_NAME = "Default Site"
+# (regular expression on the company name, Site name), used if config.ini has no [fallback_sites] section
+FALLBACK_SITES = [
+    ("akademie", "547 Akademie"),
+    ("oper|medienabt", "530 Verwaltung/Oper"),
+    ("schauspi", "529 Schauspielhaus"),
+    ("ballett", "551 Ballettzentrum"),
+]
+
+# NetBox object types handled by the syncer and their pynetbox (app, endpoint)
+ENDPOINTS = {
+    'tenants': ('tenancy', 'tenants'),
+    'manufacturers': ('dcim', 'manufacturers'),
+    'device_types': ('dcim', 'device_types'),
+    'device_roles': ('dcim', 'device_roles'),
+    'sites': ('dcim', 'sites'),
+    'locations': ('dcim', 'locations'),
+    'devices': ('dcim', 'devices'),
+    'interfaces': ('dcim', 'interfaces'),
+    'mac_addresses': ('dcim', 'mac_addresses'),
+}
+
+
+def snipe_id(item):
+    return item['custom_fields'].get(KEY_CUSTOM_FIELD)
+
+
+def name_key(item):
+    return normalize(item['name'])
+
+
+def normalize_mac(value):
+    """
+    A MAC address in the notation of NetBox (AA:BB:CC:DD:EE:FF), None if it is not a valid one
+    """
+    digits = re.sub(r"[\s:.-]", "", str(value or "")).upper()
+    if not re.fullmatch(r"[0-9A-F]{12}", digits):
+        return None
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+# lookup tables maintained per NetBox object type, see ObjectIndex
+INDEX_KEYS = {
+    'tenants': {'snipe_id': snipe_id, 'name': name_key},
+    'manufacturers': {'snipe_id': snipe_id, 'name': name_key},
+    # only Device Types which are not linked yet can be found by Model+Manufacturer
+    'device_types': {'snipe_id': snipe_id,
+                     'model': lambda i: (normalize(i['model']), normalize(i['manufacturer']['name'])) if snipe_id(i) is None else None},
+    'device_roles': {'snipe_id': snipe_id, 'name': name_key},
+    'sites': {'snipe_id': snipe_id, 'name': name_key},
+    # Locations are unique by Name within their Site and parent Location
+    'locations': {'snipe_id': snipe_id,
+                  'name': lambda i: (normalize(i['name']), i['site']['id'], i['parent']['id'] if i['parent'] else None)},
+    # Devices are unique by Name and Tenant, names are also checked for conflicts within a Site
+    'devices': {'snipe_id': snipe_id,
+                'asset_tag': lambda i: i['asset_tag'] or None,
+                'name': lambda i: (normalize(i['name']), i['tenant']['id']) if normalize(i['name']) and i['tenant'] else None,
+                'site_name': lambda i: (normalize(i['name']), i['site']['id'], i['tenant']['id'] if i['tenant'] else None) if normalize(i['name']) else None},
+    # Interfaces are unique by Name within a Device
+    'interfaces': {'device_name': lambda i: (i['device']['id'], normalize(i['name']))},
+    'mac_addresses': {},
+}
+
+# the fields read per NetBox object type, only these are fetched and kept in the indexes
+FIELDS = {
+    'tenants': ('id', 'name', 'custom_fields', 'last_updated'),
+    'manufacturers': ('id', 'name', 'custom_fields', 'last_updated'),
+    'device_types': ('id', 'model', 'part_number', 'manufacturer', 'comments', 'custom_fields', 'last_updated'),
+    'device_roles': ('id', 'name', 'custom_fields', 'last_updated'),
+    'sites': ('id', 'name', 'comments', 'custom_fields', 'last_updated'),
+    'locations': ('id', 'name', 'site', 'parent', 'custom_fields', 'last_updated'),
+    'devices': ('id', 'name', 'asset_tag', 'serial', 'site', 'role', 'tenant', 'device_type', 'status', 'comments',
+                'custom_fields', 'last_updated'),
+    'interfaces': ('id', 'name', 'device', 'mac_address', 'primary_mac_address', 'last_updated'),
+    'mac_addresses': ('id', 'mac_address', 'last_updated'),
+}
+
+# the parts of a Snipe asset which end up in the NetBox device, see Syncer.__digest()
+DIGEST_FIELDS = ('id', 'name', 'asset_tag', 'serial', 'notes', 'model', 'category', 'company', 'status_label',
+                 'assigned_to', 'location', 'rtd_location')
 
 
 class Syncer:
-    def __init__(self, netbox, snipe, allow_updates: bool = False, allow_linking: bool = False):
+    def __init__(self, netbox, snipe, allow_updates: bool = False, allow_linking: bool = False, batch_size: int = 100,
+                 cache: NetboxCache = None, state: StateStore = None, fallback_rules: list = None, workers: int = 1,
+                 writer: BulkWriter = None):
+        """
+        :param fallback_rules: list of (compiled pattern, site name), the Site of assets without location is the one
+                               of the first pattern matching the company name
+        :param workers: number of threads reconciling assets in parallel
+        :param writer: receives all creates and updates, by default a BulkWriter sending them to NetBox
+        """
         self.netbox = netbox
         self.snipe = snipe
         self.allow_updates = allow_updates
         self.allow_linking = allow_linking
         self.desc = "Imported from SnipeIT {}".format(datetime.now(timezone.utc).strftime("%y-%m-%d %H:%M:%S (UTC)"))
+        self.cache = cache
+        self.state = state
+        self.__indexes = {}
+        # one lock per object type, so concurrent phases load distinct types in parallel but each one only once
+        self.__index_locks = {kind: threading.Lock() for kind in ENDPOINTS}
+        # Device Role per Snipe category id, see sync_categories_to_roles()
+        self.__roles = {}
+        self.lock = threading.RLock()
+        # (name, site, tenant) -> id of the device queued for creation (None) or renaming to it, they are not in the index until sent
+        self.__claimed_names = {}
+        # (name, site, tenant) and id of the devices queued for renaming away from it, the name is free once they are sent
+        self.__released_names = set()
+        self.fallback_rules = fallback_rules or []
+        self.__fallback_sites = {}
+        self.workers = max(1, workers)
+        self.writer = writer if writer is not None else BulkWriter(netbox, ENDPOINTS, batch_size)
+        self.reader = NetboxReader(netbox, ENDPOINTS, FIELDS, (KEY_CUSTOM_FIELD,))
 
 
     @staticmethod
@@ -26,6 +141,76 @@ class Syncer:
         value = re.sub(r"[^\w\s-]", "", value.lower())
         return re.sub(r"[-\s]+", "-", value).strip("-_")
 
+    @staticmethod
+    def count_names(snipe_assets):
+        """
+        Number of Snipe assets per normalized name, built in one pass for the name uniqueness checks
+        """
+        return Counter(normalize(asset['name']) for asset in snipe_assets if normalize(asset['name']))
+
+
+    def __index(self, kind: str) -> ObjectIndex:
+        """
+        The lookup tables for a NetBox object type. They are fetched once, or revalidated from the cache,
+        and shared by all sync phases, so every create and update has to go through the __create*() and
+        __update() functions to keep them current. The objects are kept as compact records of the FIELDS.
+        """
+        if kind not in self.__indexes:
+            with self.__index_locks[kind]:
+                if kind not in self.__indexes:
+                    endpoint = self.reader.endpoint(kind)
+                    if self.cache is not None:
+                        items = (self.reader.record(kind, item) for item in self.cache.load(kind, endpoint))
+                    else:
+                        items = endpoint.all()
+                    self.__indexes[kind] = ObjectIndex(items, **INDEX_KEYS[kind])
+        return self.__indexes[kind]
+
+    def refresh(self):
+        """
+        Drops the loaded indexes, they are loaded again (revalidated from the cache) when used next.
+        Must not be called while a sync is running.
+        """
+        self.__indexes = {}
+        self.__roles = {}
+        self.__fallback_sites = {}
+
+    def start_run(self):
+        """
+        Forgets the device names claimed and the writes counted by the previous sync, when the syncer is reused
+        """
+        with self.lock:
+            self.__claimed_names.clear()
+            self.__released_names.clear()
+        self.writer.reset()
+
+    def __indexer(self, kind: str, callback=None):
+        index = self.__index(kind)
+
+        def add(record):
+            # an update may not return all fields, e.g. in a dry run
+            current = index.get_by_id(record['id'])
+            record = self.reader.record(kind, dict(current) | dict(record) if current is not None else record)
+            index.add(record)
+            if callback is not None:
+                callback(record)
+        return add
+
+    def __create(self, kind: str, source=None, callback=None, **data):
+        """
+        Queues the creation in the bulk writer, the index receives the new object when the batch is sent
+        """
+        self.writer.create(kind, data, source, self.__indexer(kind, callback))
+
+    def __create_now(self, kind: str, **data):
+        record = self.reader.record(kind, self.writer.create_now(kind, data))
+        self.__index(kind).add(record)
+        return record
+
+    def __update(self, kind: str, updates: list, source=None, callback=None):
+        indexer = self.__indexer(kind, callback)
+        for update in updates:
+            self.writer.update(kind, update, source, indexer)
 
     def __gen_update_comment(self, old_comment: str, suffix: str = None):
         val = old_comment + '\r\n\r\n' + self.desc.replace("Imported", "Updated")
@@ -33,32 +218,29 @@ class Syncer:
             val += " (" + suffix + ")"
         return val
 
-    def __get_fallback_site(self, company_name=None):
-
-        if company_name is not None:
-            # try a hard mapping
-            # ToDo: this is not very elegant and should be configurable
-            company_name = company_name.lower()
-            if "akademie" in company_name:
-                fallback_site = self.netbox.dcim.sites.get(name="547 Akademie")
-            elif "oper" in company_name or "medienabt" in company_name:
-                fallback_site = self.netbox.dcim.sites.get(name="530 Verwaltung/Oper")
-            elif "schauspi" in company_name:
-                fallback_site = self.netbox.dcim.sites.get(name="529 Schauspielhaus")
-            elif "ballett" in company_name:
-                fallback_site = self.netbox.dcim.sites.get(name="551 Ballettzentrum")
-            else:
-                fallback_site = self.netbox.dcim.sites.get(name=DEFAULT_SITE_NAME)
+    def __get_fallback_site(self, company=None):
+        """
+        The Site for assets without a location, resolved once per company by the fallback rules
+        """
+        company_id = company['id'] if company is not None else None
 
-        else:
-            fallback_site = self.netbox.dcim.sites.get(name=DEFAULT_SITE_NAME)
+        with self.lock:
+            if company_id in self.__fallback_sites:
+                return self.__fallback_sites[company_id]
 
+            site_name = DEFAULT_SITE_NAME
+            if company is not None:
+                site_name = next((name for pattern, name in self.fallback_rules if pattern.search(company['name'])), DEFAULT_SITE_NAME)
 
-        if fallback_site is None:
-            fallback_site = self.netbox.dcim.sites.create(name=DEFAULT_SITE_NAME, slug=Syncer.slugify(DEFAULT_SITE_NAME),
-                                                          description="Default Site for SnipeIT Import", status='active')
+            netbox_sites = self.__index('sites')
+            fallback_site = netbox_sites.get('name', normalize(site_name)) or netbox_sites.get('name', normalize(DEFAULT_SITE_NAME))
 
-        return fallback_site
+            if fallback_site is None:
+                fallback_site = self.__create_now('sites', name=DEFAULT_SITE_NAME, slug=Syncer.slugify(DEFAULT_SITE_NAME),
+                                                  description="Default Site for SnipeIT Import", status='active')
+
+            self.__fallback_sites[company_id] = fallback_site
+            return fallback_site
 
     def ensure_netbox_custom_field(self, lock: bool = False):
         content_types = ['dcim.device', 'dcim.devicetype', 'dcim.interface', 'dcim.manufacturer', 'dcim.site', 'dcim.devicerole',
@@ -77,77 +259,89 @@ class Syncer:
             self.netbox.extras.custom_fields.update([cufi])
 
     def sync_companies_to_tenants(self, snipe_companies):
-        netbox_tenants = list(self.netbox.tenancy.tenants.all())
+        netbox_tenants = self.__index('tenants')
         # ToDo: remove local desc
         desc = "Imported from SnipeIT {}".format(datetime.now(timezone.utc).strftime("%y-%m-%d %H:%M:%S (UTC)"))
 
         for snipe_company in snipe_companies:
             logging.info("Checking Company {}".format(snipe_company['name']))
 
-            present_nb_tenant = next((item for item in netbox_tenants if item["custom_fields"][KEY_CUSTOM_FIELD] == snipe_company['id']), None)
+            present_nb_tenant = netbox_tenants.get('snipe_id', snipe_company['id'])
             if present_nb_tenant is None:
                 # Tenant is unique by Name
-                present_nb_tenant = next((item for item in netbox_tenants if item["name"].lower().strip() == snipe_company['name'].lower().strip()), None)
+                present_nb_tenant = netbox_tenants.get('name', normalize(snipe_company['name']))
                 if present_nb_tenant is None:
                     logging.info("Adding Tenant {} to netbox.".format(snipe_company['name']))
-                    self.netbox.tenancy.tenants.create(name=snipe_company['name'],
-                                                       slug=Syncer.slugify(snipe_company['name']),
-                                                       description=desc,
-                                                       custom_fields={KEY_CUSTOM_FIELD: snipe_company['id']})
+                    self.__create('tenants', "Company {}".format(snipe_company['name']), name=snipe_company['name'],
+                                  slug=Syncer.slugify(snipe_company['name']),
+                                  description=desc,
+                                  custom_fields={KEY_CUSTOM_FIELD: snipe_company['id']})
                 else:
                     if self.allow_linking:
                         logging.info("Found Tenant {} by name. Updating custom field instead.".format(snipe_company['name']))
-                        self.netbox.tenancy.tenants.update([{"id": present_nb_tenant["id"],
-                                                             "description": desc.replace("Imported", "Updated"),
-                                                             "custom_fields": {KEY_CUSTOM_FIELD: snipe_company['id']}}])
+                        self.__update('tenants', [{"id": present_nb_tenant["id"],
+                                                   "description": desc.replace("Imported", "Updated"),
+                                                   "custom_fields": {KEY_CUSTOM_FIELD: snipe_company['id']}}],
+                                      "Company {}".format(snipe_company['name']))
                     else:
                         logging.info("Found Tenant {} by name. Skipping, since linking is not enabled.".format(snipe_company['name']))
+                        self.writer.skipped('tenants', "Company {}".format(snipe_company['name']), "linking not enabled")
 
             elif present_nb_tenant['name'] != snipe_company['name']:
                 if self.allow_updates:
                     logging.info("The Tenant {} is present, updating Item".format(snipe_company['name']))
-                    self.netbox.tenancy.tenants.update([{"id": present_nb_tenant["id"], "name": snipe_company['name'],
-                                                         "slug": Syncer.slugify(snipe_company['name']),
-                                                         "description": desc.replace("Imported", "Updated")}])
+                    self.__update('tenants', [{"id": present_nb_tenant["id"], "name": snipe_company['name'],
+                                               "slug": Syncer.slugify(snipe_company['name']),
+                                               "description": desc.replace("Imported", "Updated")}],
+                                  "Company {}".format(snipe_company['name']))
                 else:
                     logging.info("The Tenant {} is changed. Skipping since updating is not enabled.".format(snipe_company['name']))
+                    self.writer.skipped('tenants', "Company {}".format(snipe_company['name']), "updating not enabled")
+
+        self.writer.flush('tenants')
 
     def sync_manufacturers(self, snipe_manufacturers):
-        netbox_manufacturers = list(self.netbox.dcim.manufacturers.all())
+        netbox_manufacturers = self.__index('manufacturers')
 
         for snipe_manuf in snipe_manufacturers:
             logging.info("Checking Manufacturer {}".format(snipe_manuf['name']))
 
             # search in netbox manufs for the custom field ID, if not found, search for name, if not found ->create
-            present_nb_manuf = next((item for item in netbox_manufacturers if item["custom_fields"][KEY_CUSTOM_FIELD] == snipe_manuf['id']), None)
+            present_nb_manuf = netbox_manufacturers.get('snipe_id', snipe_manuf['id'])
             if present_nb_manuf is None:
                 # Manufacturer is unique by Name
-                present_nb_manuf = next((item for item in netbox_manufacturers if item["name"].lower().strip() == snipe_manuf['name'].lower().strip()), None)
+                present_nb_manuf = netbox_manufacturers.get('name', normalize(snipe_manuf['name']))
 
                 if present_nb_manuf is None:
                     logging.info("Adding Manufacturer {} to netbox".format(snipe_manuf['name']))
-                    self.netbox.dcim.manufacturers.create(name=snipe_manuf['name'], slug=Syncer.slugify(snipe_manuf['name']),
-                                                          description=self.desc,
-                                                          custom_fields={KEY_CUSTOM_FIELD: snipe_manuf['id']})
+                    self.__create('manufacturers', "Manufacturer {}".format(snipe_manuf['name']), name=snipe_manuf['name'], slug=Syncer.slugify(snipe_manuf['name']),
+                                  description=self.desc,
+                                  custom_fields={KEY_CUSTOM_FIELD: snipe_manuf['id']})
                 else:
                     if self.allow_linking:
                         logging.info("Found Manufacturer {} by name. Updating custom field instead.".format(snipe_manuf['name']))
-                        self.netbox.dcim.manufacturers.update([{"id": present_nb_manuf["id"],
-                                                                "custom_fields": {KEY_CUSTOM_FIELD: snipe_manuf['id']}}])
+                        self.__update('manufacturers', [{"id": present_nb_manuf["id"],
+                                                         "custom_fields": {KEY_CUSTOM_FIELD: snipe_manuf['id']}}],
+                                      "Manufacturer {}".format(snipe_manuf['name']))
                     else:
                         logging.info("Found Manufacturer {} by name. Skipping, since linking is not enabled.".format(snipe_manuf['name']))
+                        self.writer.skipped('manufacturers', "Manufacturer {}".format(snipe_manuf['name']), "linking not enabled")
 
             elif present_nb_manuf['name'] != snipe_manuf['name']:
                 if self.allow_updates:
                     logging.info("The Manufacturer {} is present, updating Item".format(snipe_manuf['name']))
-                    self.netbox.dcim.manufacturers.update([{"id": present_nb_manuf["id"], "name": snipe_manuf['name'],
-                                                            "slug": Syncer.slugify(snipe_manuf['name'])}])
+                    self.__update('manufacturers', [{"id": present_nb_manuf["id"], "name": snipe_manuf['name'],
+                                                     "slug": Syncer.slugify(snipe_manuf['name'])}],
+                                  "Manufacturer {}".format(snipe_manuf['name']))
                 else:
                     logging.info("The Manufacturer {} is changed. Skipping since updating is not enabled.".format(snipe_manuf['name']))
+                    self.writer.skipped('manufacturers', "Manufacturer {}".format(snipe_manuf['name']), "updating not enabled")
+
+        self.writer.flush('manufacturers')
 
     def sync_models_to_device_types(self, snipe_models):
-        netbox_device_types = list(self.netbox.dcim.device_types.all())
-        netbox_manufacturers = list(self.netbox.dcim.manufacturers.all())
+        netbox_device_types = self.__index('device_types')
+        netbox_manufacturers = self.__index('manufacturers')
 
         for model in snipe_models:
             update_obj = {}
@@ -155,36 +349,30 @@ class Syncer:
                 logging.debug("debug me - set breakpoint here")
             logging.info("Checking Device Type {}".format(model['name']))
             # get the manufacturer by Name of the Snipe Model-Manufacturer for later use
-            manuf_by_model = next((item for item in netbox_manufacturers if item["name"] == model['manufacturer']['name']), None)
+            manuf_by_model = netbox_manufacturers.get('name', normalize(model['manufacturer']['name']))
 
             # search the Device Type by Custom Field ID-Value
-            present_nb_devtype = next((item for item in netbox_device_types if item['custom_fields'][KEY_CUSTOM_FIELD] == model['id']), None)   # ToDo: use function
+            present_nb_devtype = netbox_device_types.get('snipe_id', model['id'])
 
             if present_nb_devtype is None:  # No associated Device Type found
 
                 # Search by Model+Manufacturer, but do not update already linked devices
-                present_nb_devtype = next((item for item in netbox_device_types if item['model'].lower().strip() == model['name'].lower().strip() and
-                                           item['manufacturer']['name'].lower().strip() == model['manufacturer']['name'].lower().strip() and
-                                           item['custom_fields'][KEY_CUSTOM_FIELD] == None), None)
+                present_nb_devtype = netbox_device_types.get('model', (normalize(model['name']), normalize(model['manufacturer']['name'])))
 
                 if present_nb_devtype is None:
                     logging.info("Adding Device Type {} to netbox".format(model['name']))
 
-                    try:
-                        slug=Syncer.slugify(model['name']+" "+(model['model_number'] if model['model_number'] else ""))
-                        self.netbox.dcim.device_types.create(slug=slug,
-                                                         description=self.desc, model=model['name'],
-                                                         part_number=(model['model_number'] if model['model_number'] else ""),
-                                                         manufacturer=manuf_by_model.id,
-                                                         custom_fields={KEY_CUSTOM_FIELD: model['id']},
-                                                         comments="Notes from SnipeIT when initially creating this Netbox Entry. "
-                                                                  "\n " +
-                                                                  str(model['notes']).replace('\r\n', '\r\n\r\n'),
-                                                         is_full_depth=False, u_height=0.0)
-                    except Exception as e:
-                        logging.error("---------------------------------------------------------")
-                        logging.error("Error importing/updating Device Type, slug duplicate: Slug '{}', Manuf: '{}'".format(slug, manuf_by_model['name']))
-                        logging.error(e)
+                    slug=Syncer.slugify(model['name']+" "+(model['model_number'] if model['model_number'] else ""))
+                    self.__create('device_types', "Model {} (Slug '{}', Manuf: '{}')".format(model['name'], slug, manuf_by_model['name']),
+                                  slug=slug,
+                                  description=self.desc, model=model['name'],
+                                  part_number=(model['model_number'] if model['model_number'] else ""),
+                                  manufacturer=manuf_by_model['id'],
+                                  custom_fields={KEY_CUSTOM_FIELD: model['id']},
+                                  comments="Notes from SnipeIT when initially creating this Netbox Entry. "
+                                           "\n " +
+                                           str(model['notes']).replace('\r\n', '\r\n\r\n'),
+                                  is_full_depth=False, u_height=0.0)
                 else:
                     # Found Device Type by Mode+Manufacturer, so update the Custom Field ID-Value for proper linking
                     if self.allow_linking:
@@ -192,9 +380,10 @@ class Syncer:
                                                    "custom_fields": {KEY_CUSTOM_FIELD: model['id']},
                                                    "comments": self.__gen_update_comment(present_nb_devtype['comments'], "Snipe ID")}
                         logging.info("Found Device Type {} by Model and Manufacturer Name. Updating custom field.".format(model['name']))
-                        self.netbox.dcim.device_types.update([update_obj])
+                        self.__update('device_types', [update_obj], "Model {}".format(model['name']))
                     else:
                         logging.info("Found Device Type {} by name. Skipping, since linking is not enabled.".format(model['name']))
+                        self.writer.skipped('device_types', "Model {}".format(model['name']), "linking not enabled")
 
             else:
                 # Found associated Device Type, check if things have changed
@@ -205,19 +394,22 @@ class Syncer:
                 if present_nb_devtype['part_number'] != (model['model_number'].strip() if model['model_number'] else ""):
                     update_obj = update_obj | {"id": present_nb_devtype["id"], "part_number": (model['model_number'] if model['model_number'] else "")}
 
-                if present_nb_devtype['manufacturer']['id'] != manuf_by_model.id:
-                    update_obj = update_obj | {"id": present_nb_devtype["id"], "manufacturer": manuf_by_model.id}
+                if present_nb_devtype['manufacturer']['id'] != manuf_by_model['id']:
+                    update_obj = update_obj | {"id": present_nb_devtype["id"], "manufacturer": manuf_by_model['id']}
 
                 if "id" in update_obj:
                     if self.allow_updates:
                         logging.info("The Device Type {} has changed, updating Item".format(model['name']))
                         update_obj = update_obj | {"comments": self.__gen_update_comment(present_nb_devtype['comments'], "Values")}
-                        self.netbox.dcim.device_types.update([update_obj])
+                        self.__update('device_types', [update_obj], "Model {}".format(model['name']))
                     else:
                         logging.info("The Device Type {} has changed. Skipping since updating is not enabled.".format(model['name']))
+                        self.writer.skipped('device_types', "Model {}".format(model['name']), "updating not enabled")
+
+        self.writer.flush('device_types')
 
     def sync_top_locations_to_sites(self, locations):
-        netbox_sites = list(self.netbox.dcim.sites.all())
+        netbox_sites = self.__index('sites')
 
         # the top locations without a parent will be the Sites in NetBox
         top_locations = list(filter(lambda s: s['parent'] is None, locations))
@@ -225,193 +417,309 @@ class Syncer:
         for location in top_locations:
             logging.info("Checking Top Location as Site: {}".format(location['name']))
 
-            present_nb_site = next((item for item in netbox_sites if item['custom_fields'][KEY_CUSTOM_FIELD] == location['id']), None)   # ToDo: use function
+            present_nb_site = netbox_sites.get('snipe_id', location['id'])
             if present_nb_site is None:
                 # Site is unique by Name
-                present_nb_site = next((item for item in netbox_sites if item["name"].lower().strip() == location['name'].lower().strip()), None)   # ToDo: use function
+                present_nb_site = netbox_sites.get('name', normalize(location['name']))
 
                 if present_nb_site is None:
                     logging.info("Adding Site {} to netbox".format(location['name']))
-                    self.netbox.dcim.sites.create(name=location['name'], slug=Syncer.slugify(location['name']),
-                                                  description=self.desc, status='active',
-                                                  custom_fields={KEY_CUSTOM_FIELD: location['id']})
+                    self.__create('sites', "Location {}".format(location['name']), name=location['name'], slug=Syncer.slugify(location['name']),
+                                  description=self.desc, status='active',
+                                  custom_fields={KEY_CUSTOM_FIELD: location['id']})
                 else:
                     if self.allow_linking:
                         logging.info("Found Site {} by name. Updating custom field instead.".format(location['name']))
-                        self.netbox.dcim.sites.update([{"id": present_nb_site["id"],
-                                                        "comments": self.__gen_update_comment(present_nb_site['comments'], "Snipe ID"),
-                                                        "custom_fields": {KEY_CUSTOM_FIELD: location['id']}}])
+                        self.__update('sites', [{"id": present_nb_site["id"],
+                                                 "comments": self.__gen_update_comment(present_nb_site['comments'], "Snipe ID"),
+                                                 "custom_fields": {KEY_CUSTOM_FIELD: location['id']}}],
+                                      "Location {}".format(location['name']))
                     else:
                         logging.info("Found Site {} by name. Skipping, since linking is not enabled.".format(location['name']))
+                        self.writer.skipped('sites', "Location {}".format(location['name']), "linking not enabled")
 
             elif present_nb_site['name'] != location['name']:
                 if self.allow_updates:
                     logging.info("The Site {} is present, updating Item".format(location['name']))
-                    self.netbox.dcim.sites.update([{"id": present_nb_site["id"], "name": location['name'],
-                                                    "slug": Syncer.slugify(location['name']),
-                                                    "comments": self.__gen_update_comment(present_nb_site['comments'],"Values"),
-                                                    }])
+                    self.__update('sites', [{"id": present_nb_site["id"], "name": location['name'],
+                                             "slug": Syncer.slugify(location['name']),
+                                             "comments": self.__gen_update_comment(present_nb_site['comments'],"Values"),
+                                             }],
+                                  "Location {}".format(location['name']))
                 else:
                     logging.info("The Site {} is changed. Skipping since updating is not enabled.".format(location['name']))
+                    self.writer.skipped('sites', "Location {}".format(location['name']), "updating not enabled")
 
+        self.writer.flush('sites')
 
 
-    def __sync_location(self, netbox_sites, netbox_locations, locations_with_parents, location):
-        logging.info("Checking Location {}".format(location['name']))
-        # try to find the site
-        parent = location['parent']
-        site = None
-
-        # traverse up the tree to find the top location which is the Site
-        while site is None:
-            if parent is not None:
-                logging.debug("parent: {}".format(parent['name']))
-                site = next((item for item in netbox_sites if item['custom_fields'][KEY_CUSTOM_FIELD] == parent['id']), None)   # ToDo: use function
-            else:
-                logging.error("can not find the Site for Location {}".format(location['name']))
-                return
-
-            parent_item = next((item for item in locations_with_parents if item['id'] == parent['id']), None)   # ToDo: use function
-            if parent_item is not None:
-                parent = parent_item['parent']
-            else:
-                parent = None
-
 
+    def __sync_location(self, netbox_locations, location, site, nb_parent):
+        """
+        Creates or updates a single Location below the given Site and parent Location (None directly below the Site)
+        :return: the NetBox Location if it was found by name but not linked
+        """
+        logging.info("Checking Location {}".format(location['name']))
         logging.debug("Site for Location {} will be {}".format(location['name'], site['name']))
 
+        parent_id = nb_parent['id'] if nb_parent is not None else None
+
         # check if we can find the location by Snipe ID
-        present_nb_loc = next((item for item in netbox_locations if item['custom_fields'][KEY_CUSTOM_FIELD] == location['id']), None)   # ToDo: use function
+        present_nb_loc = netbox_locations.get('snipe_id', location['id'])
 
         if present_nb_loc is None:
-            # not found by ID, so Location is unique by Name within a Site, try find it
-            present_nb_loc = next((item for item in netbox_locations if item["name"].lower().strip() == location['name'].lower().strip() and item['site']['id'] == site['id']), None)   # ToDo: use function
+            # not found by ID, so Location is unique by Name within a Site and parent Location, try find it
+            present_nb_loc = netbox_locations.get('name', (normalize(location['name']), site['id'], parent_id))
 
             if present_nb_loc is None:
                 logging.info("Adding Location {} to netbox".format(location['name']))
-                self.netbox.dcim.locations.create(name=location['name'], slug=Syncer.slugify(location['name']),
-                                                  description=self.desc, status='active', site=site['id'],
-                                                  custom_fields={KEY_CUSTOM_FIELD: location['id']})
+                self.__create('locations', "Location {}".format(location['name']), name=location['name'], slug=Syncer.slugify(location['name']),
+                              description=self.desc, status='active', site=site['id'], parent=parent_id,
+                              custom_fields={KEY_CUSTOM_FIELD: location['id']})
             else:
                 if self.allow_linking:
                     logging.info("Found Location {} by name. Updating custom field instead.".format(location['name']))
-                    self.netbox.dcim.locations.update([{"id": present_nb_loc["id"],
-                                                        "custom_fields": {KEY_CUSTOM_FIELD: location['id']}}])
+                    self.__update('locations', [{"id": present_nb_loc["id"],
+                                                 "custom_fields": {KEY_CUSTOM_FIELD: location['id']}}],
+                                  "Location {}".format(location['name']))
                 else:
                     logging.info("Found Location {} by name. Skipping, since linking is not enabled.".format(location['name']))
+                    self.writer.skipped('locations', "Location {}".format(location['name']), "linking not enabled")
+                return present_nb_loc
         else:
             # is present, so check if changed and we may update
-            if present_nb_loc['name'] != location['name'] or present_nb_loc['site']['id'] != site['id']:
+            parent_changed = parent_id is not None and (present_nb_loc['parent'] is None or present_nb_loc['parent']['id'] != parent_id)
+            if present_nb_loc['name'] != location['name'] or present_nb_loc['site']['id'] != site['id'] or parent_changed:
                 if self.allow_updates:
                     logging.info("The Location {} has changed, updating Item".format(location['name']))
-                    self.netbox.dcim.locations.update([{"id": present_nb_loc["id"], "name": location['name'],
-                                                        "site": site['id'],
-                                                        "slug": Syncer.slugify(location['name'])
-                                                        }])
+                    update = {"id": present_nb_loc["id"], "name": location['name'],
+                              "site": site['id'],
+                              "slug": Syncer.slugify(location['name'])
+                              }
+                    if parent_id is not None:
+                        update = update | {"parent": parent_id}
+                    self.__update('locations', [update], "Location {}".format(location['name']))
                 else:
                     logging.info("The Location {} has changed. Skipping since updating is not enabled.".format(location['name']))
-
-    def __sync_location_relationships(self, sub_locations):
-        # get them fresh from the API
-        netbox_locations = list(self.netbox.dcim.locations.all())
-        updates = []
-
-        for snipe_location in sub_locations:
-            present_nb_loc = next((item for item in netbox_locations if item['custom_fields'][KEY_CUSTOM_FIELD] == snipe_location['id']), None)  # ToDo: use function
-            assert present_nb_loc is not None
-            present_nb_parent_loc = next((item for item in netbox_locations if item['custom_fields'][KEY_CUSTOM_FIELD] == snipe_location['parent']['id']), None)  # ToDo: use function
-            assert present_nb_parent_loc is not None
-
-            if present_nb_loc and present_nb_loc['parent'] and present_nb_parent_loc and present_nb_loc['parent']['id'] != present_nb_parent_loc['id']:
-                if self.allow_updates:
-                    logging.info("The Location {} has changed, updating Item".format(present_nb_loc['name']))
-                    updates.append({"id": present_nb_loc["id"], "parent": present_nb_parent_loc['id']})
-                else:
-                    logging.info("The Location {} has changed. Skipping since updating is not enabled.".format(present_nb_loc['name']))
-
-        # update all at once
-        self.netbox.dcim.locations.update(updates)
+                    self.writer.skipped('locations', "Location {}".format(location['name']), "updating not enabled")
+        return None
 
     def sync_locations(self, locations):
-        netbox_locations = list(self.netbox.dcim.locations.all())
-        netbox_sites = list(self.netbox.dcim.sites.all())
-
-        snipe_locations_with_parent = list(filter(lambda s: s['parent'] is not None, locations))
-
-        snipe_sub_locations = []
-
-        for snipe_location in snipe_locations_with_parent:
-            # check if the locations's parent is a NetBox Site, then it is considered a top level Location
-            if next((item for item in netbox_sites if item['custom_fields'][KEY_CUSTOM_FIELD] == snipe_location['parent']['id']), None) is None:    # ToDo: use function
-                snipe_sub_locations.append(snipe_location)
-
-
-        for snipe_location in snipe_locations_with_parent:
-            self.__sync_location(netbox_sites, netbox_locations, snipe_locations_with_parent, snipe_location)
+        """
+        Syncs all Locations below the top Locations (the Sites). The location tree is built once and processed
+        top-down, one level at a time, so each Location is created or updated together with its parent.
+        """
+        netbox_locations = self.__index('locations')
+        netbox_sites = self.__index('sites')
+
+        children = {}
+        for location in locations:
+            if location['parent'] is not None:
+                children.setdefault(location['parent']['id'], []).append(location)
+
+        # NetBox Site per Snipe Location id and the NetBox Locations found by name, but not linked
+        location_sites = {}
+        unlinked = {}
+
+        level = [location for location in locations if location['parent'] is None]
+        while level:
+            level = [child for parent in level for child in children.pop(parent['id'], [])]
+
+            for location in level:
+                parent_id = location['parent']['id']
+                # a Location directly below a Site has no parent Location
+                site = netbox_sites.get('snipe_id', parent_id)
+                below_site = site is not None
+                nb_parent = None
+                if not below_site:
+                    site = location_sites.get(parent_id)
+                    nb_parent = netbox_locations.get('snipe_id', parent_id) or unlinked.get(parent_id)
+
+                location_sites[location['id']] = site
+                if site is None:
+                    logging.error("can not find the Site for Location {}".format(location['name']))
+                    continue
+                if not below_site and nb_parent is None:
+                    logging.error("can not find the parent Location of Location {}".format(location['name']))
+                    continue
+
+                present_nb_loc = self.__sync_location(netbox_locations, location, site, nb_parent)
+                if present_nb_loc is not None:
+                    unlinked[location['id']] = present_nb_loc
+
+            # the next level needs the ids of the created Locations
+            self.writer.flush('locations')
+
+        for location in (location for orphans in children.values() for location in orphans):
+            logging.error("can not find the Site for Location {}".format(location['name']))
 
-        self.__sync_location_relationships(snipe_sub_locations)
 
     @staticmethod
-    def __get_customfield_from_dict_list(the_list: list, needle: int):
-        return next((item for item in the_list if item["custom_fields"][KEY_CUSTOM_FIELD] == needle), None)
-
-
-    def __get_role_from_category(self, netbox_roles, snipe_asset):
-        category_name = snipe_asset['category']['name']
-        # ToDo: take the category name, if contains a hyphen, only take first part upto the
-        #  hypen (trim). Then search for that name, if not found -> create a new role
-
+    def role_name(category_name: str) -> str:
+        """
+        The Device Role of a category: its name up to the first hyphen, e.g. "Laptop - Office" -> "Laptop"
+        """
         hypos = category_name.find("-")
         if hypos > 1:
             category_name = category_name[0:hypos].strip()
+        return category_name
 
-        # first search by snipe id in the custom field
-        role = Syncer.__get_customfield_from_dict_list(netbox_roles, snipe_asset['category']['id'])
+    def sync_categories_to_roles(self, categories: dict):
+        """
+        Resolves the Device Roles of the given Snipe categories in one go: by the linked category id, else by the
+        role name. Missing roles are created and unlinked ones linked in one bulk request. Categories sharing
+        a role name share the role, it stays linked to the first one so runs do not relink it back and forth.
+        :param categories: Snipe category id -> category
+        """
+        netbox_roles = self.__index('device_roles')
+
+        with self.lock:
+            # role name -> categories waiting for the role to be created
+            waiting = {}
+            # roles linked in this pass, the index only knows about the link once it is sent
+            linked = set()
+            for category_id, category in categories.items():
+                if category_id in self.__roles:
+                    continue
+                role = netbox_roles.get('snipe_id', category_id)
+                if role is not None:
+                    self.__roles[category_id] = role
+                    continue
+
+                name = Syncer.role_name(category['name'])
+                role = netbox_roles.get('name', normalize(name))
+                if role is None:
+                    waiting.setdefault(normalize(name), []).append((category_id, name))
+                    continue
+                self.__roles[category_id] = role
+                if snipe_id(role) is None and role['id'] not in linked:
+                    linked.add(role['id'])
+                    self.__update('device_roles', [{"id": role['id'], "custom_fields": {KEY_CUSTOM_FIELD: category_id}}],
+                                  "Category {}".format(category['name']), self.__role_linked(role['id']))
+
+            for sharing in waiting.values():
+                category_id, name = sharing[0]
+                # stays None if the creation fails, so the assets of the category do not try again
+                self.__roles.update((cid, None) for cid, _ in sharing)
+                logging.info("Adding Device Role {} to netbox.".format(name))
+                self.__create('device_roles', "Category {}".format(name), self.__role_created([cid for cid, _ in sharing]),
+                              name=name, slug=Syncer.slugify(name), custom_fields={KEY_CUSTOM_FIELD: category_id})
+            self.writer.flush('device_roles')
+
+    def __role_linked(self, role_id: int):
+        def linked(record):
+            for category_id, role in list(self.__roles.items()):
+                if role is not None and role['id'] == role_id:
+                    self.__roles[category_id] = record
+        return linked
+
+    def __role_created(self, category_ids: list):
+        def created(record):
+            for category_id in category_ids:
+                self.__roles[category_id] = record
+        return created
+
+    def __get_role_from_category(self, snipe_asset):
+        """
+        The role resolved for the category of the asset, categories missing in the pre-pass (streamed assets)
+        are resolved on their first asset. None if the role could not be created.
+        """
+        category = snipe_asset['category']
+        role = self.__roles.get(category['id'])
         if role is None:
-            # then search by the name
-            role = next((item for item in netbox_roles if item['name'] == category_name), None)
-
-            if role is not None:
-                # then update the custom field id
-                self.netbox.dcim.device_roles.update([{"id": role['id'],
-                                                       "custom_fields": {KEY_CUSTOM_FIELD: snipe_asset['category']['id']}}])
+            # also waits for a creation by another thread, which holds the lock until the role is sent
+            self.sync_categories_to_roles({category['id']: category})
+            role = self.__roles.get(category['id'])
+        return role
 
-        if role is None:
-            role = self.netbox.dcim.device_roles.create(name=category_name,
-                                                        slug=Syncer.slugify(category_name))
-            netbox_roles.append(role)
+    def __claim_device_name(self, name: str, site_id: int, tenant_id: int, device: dict) -> bool:
+        """
+        Reserves a device name within a Site and Tenant for this run when a device is renamed.
+        Returns False if it is already used by another device, as the names will be once the queued writes are sent:
+        names claimed by devices not sent yet are taken, names devices are renamed away from are free.
+        """
+        key = (normalize(name), site_id, tenant_id)
+        with self.lock:
+            if key in self.__claimed_names and self.__claimed_names[key] != device['id']:
+                return False
+            if any(other['id'] != device['id'] and (key, other['id']) not in self.__released_names
+                   for other in self.__index('devices').get_all('site_name', key)):
+                return False
+            self.__claimed_names[key] = device['id']
+            current = INDEX_KEYS['devices']['site_name'](device)
+            if current is not None and current != key:
+                self.__released_names.add((current, device['id']))
+            return True
 
-        return netbox_roles, role
+    @staticmethod
+    def __digest(snipe_asset, *context):
+        """
+        Digest of the synced parts of a Snipe asset and the NetBox objects they resolve to
+        """
+        payload = [snipe_asset[field] for field in DIGEST_FIELDS] + list(context)
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=lambda value: dict(value) if isinstance(value, Record) else str(value))
+                            .encode()).hexdigest()
 
+    def sync_assets_to_devices(self, snipe_assets, update_unique_existing, no_append_assettag, name_counts: Counter = None):
+        """
+        :param snipe_assets: list of assets or an iterator streaming them while they are fetched
+        :param name_counts: number of assets per normalized name, if the given assets are not the whole inventory
+        :return: the MAC fields per asset id, for sync_interfaces()
+        """
+        netbox_devices = self.__index('devices')
+        netbox_tenants = self.__index('tenants')
+        netbox_sites = self.__index('sites')
+        netbox_locations = self.__index('locations')
+        netbox_device_types = self.__index('device_types')
+
+        # digest of the last synced state per asset together with the last_updated of its device
+        synced_digests = self.state.items('asset_digest') if self.state is not None else {}
+        new_digests = {}
+
+        def remember(asset_id, digest):
+            def synced(record):
+                # stored batch by batch, so an interrupted run can skip the assets synced so far
+                with self.lock:
+                    new_digests[str(asset_id)] = [digest, record['last_updated']]
+                    if len(new_digests) >= self.writer.batch_size:
+                        self.state.set_many('asset_digest', new_digests)
+                        new_digests.clear()
+            return synced
 
-    def sync_assets_to_devices(self, snipe_assets, update_unique_existing, no_append_assettag):
-        netbox_devices = list(self.netbox.dcim.devices.all())
-        netbox_tenants = list(self.netbox.tenancy.tenants.all())
-        netbox_sites = list(self.netbox.dcim.sites.all())
-        netbox_locations = list(self.netbox.dcim.locations.all())
-        netbox_roles = list(self.netbox.dcim.device_roles.all())
-        netbox_device_types = list(self.netbox.dcim.device_types.all())
+        fallback_site = None
+        if (update_unique_existing or no_append_assettag) and name_counts is None:
+            if not isinstance(snipe_assets, list):
+                # the name uniqueness needs to know all assets in advance
+                logging.info("Name uniqueness checks enabled, fetching all assets before syncing")
+                snipe_assets = list(snipe_assets)
+            name_counts = Syncer.count_names(snipe_assets)
 
+        if isinstance(snipe_assets, list):
+            self.sync_categories_to_roles({snipe_asset['category']['id']: snipe_asset['category'] for snipe_asset in snipe_assets
+                                           if snipe_asset['category'] is not None})
 
-        fallback_site = None
+        asset_macs = {}
 
-        for snipe_asset in snipe_assets:
+        def sync_asset(snipe_asset):
             logging.info("Checking Asset: {} Tag: {}".format(snipe_asset['name'], snipe_asset['asset_tag']))
+            asset_macs[str(snipe_asset['id'])] = [list(mac) for mac in snipe_asset['macs']]
             if snipe_asset['name'] == "xxxxxxxxxxxxxx":
                 logging.debug("debug me - set breakpoint here")
 
             if update_unique_existing or no_append_assettag:
                 # check if the name is unique in snipeit
-                otherAsset = next((item for item in snipe_assets if (item["name"] and item["name"].lower().strip() == snipe_asset['name'].lower().strip() and item['id'] != snipe_asset['id'])), None)
-                unique = (not otherAsset)
+                unique = name_counts[normalize(snipe_asset['name'])] <= 1
             else:
                 unique = False
 
-            nb_device_type = Syncer.__get_customfield_from_dict_list(netbox_device_types, snipe_asset['model']['id'])
+            # a missing dependency is a failure, so the watermark stays behind the asset until it can be synced
+            source = "Asset: {} Tag: {}".format(snipe_asset['name'], snipe_asset['asset_tag'])
+
+            nb_device_type = netbox_device_types.get('snipe_id', snipe_asset['model']['id'])
 
             if not nb_device_type:
-                logging.warn("No device type! skipping")
-                continue
+                self.writer.failed('devices', 'sync', source, LookupError("No device type for model {}".format(snipe_asset['model']['name'])))
+                return
 
             location = None
             # Location:
@@ -429,36 +737,189 @@ class Syncer:
             else:
                 locationId = None
 
+            location_site = None
             if locationId:
-                location = Syncer.__get_customfield_from_dict_list(netbox_locations, locationId)
+                location = netbox_locations.get('snipe_id', locationId)
+                if location is None:
+                    location_site = netbox_sites.get('snipe_id', locationId)
+                    if location_site is None:
+                        self.writer.failed('devices', 'sync', source, LookupError("No Location or Site for location {}".format(locationId)))
+                        return
+
+            nb_tenant = None
+            if snipe_asset['company'] is not None:
+                nb_tenant = netbox_tenants.get('snipe_id', snipe_asset['company']['id'])
 
             if location is not None:
                 site = location['site']
             elif locationId:
-                site = Syncer.__get_customfield_from_dict_list(netbox_sites, locationId)
+                site = location_site
             elif snipe_asset['company'] is not None:
-                site = self.__get_fallback_site(snipe_asset['company']['name'])
+                site = self.__get_fallback_site(snipe_asset['company'])
             else:
                 site = None
 
-            nb_tenant = None
-            if snipe_asset['company'] is not None:
-                nb_tenant = Syncer.__get_customfield_from_dict_list(netbox_tenants, snipe_asset['company']['id'])
+            role = self.__get_role_from_category(snipe_asset)
+            if role is None:
+                self.writer.failed('devices', 'sync', source, LookupError("No device role for category {}".format(snipe_asset['category']['name'])))
+                return
 
-            netbox_roles, role = self.__get_role_from_category(netbox_roles, snipe_asset)
+            on_synced = None
+            if self.state is not None:
+                # the Site and Role change without the asset, e.g. a Location moved to another Site or a fallback rule
+                digest = Syncer.__digest(snipe_asset, unique, update_unique_existing, no_append_assettag, nb_device_type['id'],
+                                         location['id'] if location else None, location_site['id'] if location_site else None,
+                                         nb_tenant['id'] if nb_tenant else None, site['id'] if site else None, role['id'])
+                device = netbox_devices.get('snipe_id', snipe_asset['id'])
+                if device is not None and synced_digests.get(str(snipe_asset['id'])) == [digest, device['last_updated']]:
+                    logging.debug("Asset {} is unchanged since the last sync, skipping".format(snipe_asset['asset_tag']))
+                    self.writer.skipped('devices')
+                    return
+                on_synced = remember(snipe_asset['id'], digest)
 
             try:
-                self.__sync_device(nb_device_type, nb_tenant, netbox_devices, role, site, snipe_asset, update_unique_existing, unique, no_append_assettag)
+                self.__sync_device(nb_device_type, nb_tenant, netbox_devices, role, site, snipe_asset, update_unique_existing, unique, no_append_assettag,
+                                   on_synced)
             except Exception as e:
-                logging.error("---------------------------------------------------------")
-                logging.error("Error importing/updating Asset: {} Tag: {}".format(snipe_asset['name'], snipe_asset['asset_tag']))
-                logging.error(e)
+                self.writer.failed('devices', 'sync', source, e)
+
+        if self.workers > 1:
+            self.__run_partitioned(snipe_assets, sync_asset)
+        else:
+            for snipe_asset in snipe_assets:
+                sync_asset(snipe_asset)
 
+        self.writer.flush()
+        if new_digests:
+            self.state.set_many('asset_digest', new_digests)
+        return asset_macs
 
-    def __update_device(self, nb_device, snipe_device, nb_role, nb_site, nb_tenant, nb_device_type, nb_status, update_custom_field_id: bool = False):
+    def __mac_objects(self) -> bool:
+        """
+        NetBox 4.2 keeps MAC addresses as objects assigned to interfaces, before they were a field of the interface
+        """
+        version = self.netbox.version
+        if not version:
+            return True
+        return tuple(int(part) for part in version.split('.')[:2]) >= (4, 2)
+
+    @staticmethod
+    def __interface_mac(interface, netbox_macs):
+        # the mac_address of a cached Interface is not revalidated when only its MAC address object changes
+        if netbox_macs is None or interface['primary_mac_address'] is None:
+            return interface['mac_address']
+        primary = netbox_macs.get_by_id(interface['primary_mac_address']['id'])
+        return primary['mac_address'] if primary is not None else None
+
+    def sync_interfaces(self, asset_macs: dict):
+        """
+        Creates an Interface per MAC custom field of the Devices, named like the field, and assigns the MAC to it.
+        All Interfaces and MAC addresses are fetched once and the changes are sent in bulk: the new Interfaces,
+        then their MAC addresses, then the primary MAC addresses of the Interfaces.
+        Interfaces of MAC fields removed in Snipe are left in NetBox.
+        :param asset_macs: Snipe asset id -> list of (field name, MAC)
+        """
+        netbox_devices = self.__index('devices')
+        netbox_interfaces = self.__index('interfaces')
+        mac_objects = self.__mac_objects()
+        netbox_macs = self.__index('mac_addresses') if mac_objects else None
+
+        # (device id, interface name, MAC, source) of the Interfaces which need a MAC address object
+        missing_macs = []
+        for asset_id, macs in asset_macs.items():
+            device = netbox_devices.get('snipe_id', int(asset_id))
+            if device is None:
+                continue
+
+            for field_name, value in macs:
+                source = "Asset {} Interface {}".format(asset_id, field_name)
+                mac = normalize_mac(value)
+                if mac is None:
+                    logging.warning("Invalid MAC address {} in {}, skipping".format(value, source))
+                    self.writer.skipped('interfaces')
+                    continue
+
+                interface = netbox_interfaces.get('device_name', (device['id'], normalize(field_name)))
+                if interface is None:
+                    logging.info("Adding Interface {} with MAC {} to Device {}".format(field_name, mac, device['name']))
+                    data = {'device': device['id'], 'name': field_name, 'type': 'other'}
+                    if not mac_objects:
+                        data['mac_address'] = mac
+                    self.__create('interfaces', source, **data)
+                elif normalize_mac(self.__interface_mac(interface, netbox_macs)) != mac:
+                    logging.info("The MAC of Interface {} of Device {} has changed to {}".format(field_name, device['name'], mac))
+                    if not mac_objects:
+                        self.__update('interfaces', [{'id': interface['id'], 'mac_address': mac}], source)
+                else:
+                    self.writer.skipped('interfaces')
+                    continue
+
+                if mac_objects:
+                    missing_macs.append((device['id'], field_name, mac, source))
+
+        self.writer.flush('interfaces')
+        if not mac_objects:
+            return
+
+        primaries = []
+
+        def assigned(interface, source):
+            return lambda record: primaries.append(({'id': interface['id'], 'primary_mac_address': record['id']}, source))
+
+        for device_id, field_name, mac, source in missing_macs:
+            # the new Interfaces are in the index now, unless they failed
+            interface = netbox_interfaces.get('device_name', (device_id, normalize(field_name)))
+            if interface is None:
+                continue
+            primary = interface['primary_mac_address']
+            if primary is not None and netbox_macs.get_by_id(primary['id']) is not None:
+                self.__update('mac_addresses', [{'id': primary['id'], 'mac_address': mac}], source)
+            else:
+                self.__create('mac_addresses', source, assigned(interface, source), mac_address=mac,
+                              assigned_object_type='dcim.interface', assigned_object_id=interface['id'])
+        self.writer.flush('mac_addresses')
+
+        for update, source in primaries:
+            self.__update('interfaces', [update], source)
+        self.writer.flush('interfaces')
+
+
+    def __run_partitioned(self, snipe_assets, sync_asset):
+        """
+        Runs sync_asset for the assets on a pool of worker threads. Assets are partitioned by name, so all
+        assets with the same name are handled by the same worker in their original order.
+        """
+        partitions = [queue.Queue(maxsize=self.writer.batch_size) for _ in range(self.workers)]
+
+        def work(partition: queue.Queue):
+            while (snipe_asset := partition.get()) is not None:
+                try:
+                    sync_asset(snipe_asset)
+                except Exception as e:
+                    self.writer.failed('devices', 'sync', "Asset: {} Tag: {}".format(snipe_asset['name'], snipe_asset['asset_tag']), e)
+
+        workers = [threading.Thread(target=work, args=(partition,), name="sync-{}".format(i), daemon=True)
+                   for i, partition in enumerate(partitions)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for snipe_asset in snipe_assets:
+                key = normalize(snipe_asset['name']) or snipe_asset['id']
+                partitions[hash(key) % self.workers].put(snipe_asset)
+        finally:
+            # also if fetching the assets fails, so the workers finish the queued assets and end
+            for partition in partitions:
+                partition.put(None)
+            for worker in workers:
+                worker.join()
+
+    def __update_device(self, nb_device, snipe_device, nb_role, nb_site, nb_tenant, nb_device_type, nb_status, update_custom_field_id: bool = False,
+                        on_synced=None):
         """
         This function updates a netbox device. It will check for changed properties and only write to netbox if something has changed
         :param update_custom_field_id: This sets when the linking ID should be updated
+        :param on_synced: called with the device record once it matches the Snipe asset
         """
         update_dict = {'id': nb_device['id']}
 
@@ -503,10 +964,13 @@ class Syncer:
                 name = None
             else:
                 # check for possible name conflict
-                if self.netbox.dcim.devices.get(name=check_name, site_id=nb_site['id'], tenant_id=nb_tenant['id']):
-                    name = "{} {}".format(check_name, snipe_device['asset_tag'])
-                else:
+                # the Site and Tenant the device has once the update is sent
+                site_id = update_dict.get('site', nb_device['site']['id'])
+                tenant_id = update_dict.get('tenant', nb_device['tenant']['id'] if nb_device['tenant'] else None)
+                if self.__claim_device_name(check_name, site_id, tenant_id, nb_device):
                     name = snipe_device['name']
+                else:
+                    name = "{} {}".format(check_name, snipe_device['asset_tag'])
 
             update_dict = update_dict | {'name': name}
 
@@ -514,14 +978,19 @@ class Syncer:
         if len(update_dict.values()) > 1:
             update_dict = update_dict | {"comments": self.__gen_update_comment(nb_device['comments'], "Snipe ID" if "custom_fields" in update_dict.keys() else "Values")}
             logging.info("Updating Device {}".format(update_dict))
-            self.netbox.dcim.devices.update([update_dict])
+            self.__update('devices', [update_dict], "Asset: {} Tag: {}".format(snipe_device['name'], snipe_device['asset_tag']), on_synced)
+        else:
+            self.writer.skipped('devices')
+            if on_synced is not None:
+                on_synced(nb_device)
 
 
 
-    def __sync_device(self, nb_device_type, nb_tenant, netbox_devices, nb_role, nb_site, snipe_asset, update_unique_existing, unique, no_append_assettag):
+    def __sync_device(self, nb_device_type, nb_tenant, netbox_devices, nb_role, nb_site, snipe_asset, update_unique_existing, unique, no_append_assettag,
+                      on_synced=None):
 
         # try finding by SnipeID, this will be a hard unique association:
-        device = next((item for item in netbox_devices if item["custom_fields"][KEY_CUSTOM_FIELD] == snipe_asset['id']), None)
+        device = netbox_devices.get('snipe_id', snipe_asset['id'])
 
         nb_status = 'active'
         if snipe_asset['status_label']['status_meta'] in ['undeployable', 'pending']: # deployed, deployable
@@ -529,6 +998,7 @@ class Syncer:
             if snipe_asset['assigned_to'] == None:
                 if not device:
                     # no not create undeployable and not deployed device
+                    self.writer.skipped('devices')
                     return
                 #else
                     # fixme: change location to none?
@@ -537,24 +1007,24 @@ class Syncer:
 
         if device is not None:
             # check if updating is allowed, then check changed fields and update
-            self.__update_device(device, snipe_asset, nb_role, nb_site, nb_tenant, nb_device_type,  nb_status, False)
+            self.__update_device(device, snipe_asset, nb_role, nb_site, nb_tenant, nb_device_type,  nb_status, False, on_synced)
             return
 
         # try finding by Asset Tag, the Tag is a required field in Snipe and Optional in Netbox
-        device = next((item for item in netbox_devices if item["asset_tag"] and item["asset_tag"] == snipe_asset['asset_tag']), None)
+        device = netbox_devices.get('asset_tag', snipe_asset['asset_tag'])
         if device is not None:
             # check if updating is allowed, then check changed fields and update
-            self.__update_device(device, snipe_asset, nb_role, nb_site, nb_tenant, nb_device_type, nb_status, True)
+            self.__update_device(device, snipe_asset, nb_role, nb_site, nb_tenant, nb_device_type, nb_status, True, on_synced)
             return
 
 
-        if unique and update_unique_existing:
+        if unique and update_unique_existing and nb_tenant is not None:
             # Try finding device by Name and Tenant, Netbox has a unique constraint to that two fields
-            device = next((item for item in netbox_devices if (item["name"] and item["name"].lower().strip() == snipe_asset['name'].lower().strip() and item['tenant'] is not None and item['tenant']['id'] == nb_tenant['id'])), None)
+            device = netbox_devices.get('name', (normalize(snipe_asset['name']), nb_tenant['id']))
             # If a device with the same Name and Tenant is found update it
             if device is not None:
                 # check if updating is allowed, then check changed fields and update
-                self.__update_device(device, snipe_asset, nb_role, nb_site, nb_tenant, nb_device_type, nb_status, True)
+                self.__update_device(device, snipe_asset, nb_role, nb_site, nb_tenant, nb_device_type, nb_status, True, on_synced)
                 return
                 
         # if no device is found with same uniqe name and same tenant we add the Asset Tag to the Name and create a new Device
@@ -567,21 +1037,22 @@ class Syncer:
             name = snipe_asset['asset_tag']
 
         logging.info("Adding Device to netbox, name {}".format(name))
-        device = self.netbox.dcim.devices.create(name=name,
-                                                 comments="Notes from SnipeIT when initially creating this Netbox Entry. "
-                                                          "\n " +
-                                                          str(snipe_asset['notes']).replace('\r\n', '\r\n\r\n'),
-                                                 description=self.desc,
-                                                 status=nb_status,
-                                                 site=nb_site['id'] if nb_site else 1,
-                                                 asset_tag=snipe_asset['asset_tag'],
-                                                 role=nb_role['id'],
-                                                 serial=snipe_asset['serial'],
-                                                 device_type=nb_device_type['id'],
-                                                 tenant=nb_tenant['id'] if nb_tenant is not None else None,
-                                                 custom_fields={KEY_CUSTOM_FIELD: snipe_asset['id']})
-
-        netbox_devices.append(device)
+        with self.lock:
+            self.__claimed_names[(normalize(name), nb_site['id'] if nb_site else 1, nb_tenant['id'] if nb_tenant is not None else None)] = None
+        self.__create('devices', "Asset: {} Tag: {}".format(snipe_asset['name'], snipe_asset['asset_tag']), on_synced,
+                      name=name,
+                      comments="Notes from SnipeIT when initially creating this Netbox Entry. "
+                               "\n " +
+                               str(snipe_asset['notes']).replace('\r\n', '\r\n\r\n'),
+                      description=self.desc,
+                      status=nb_status,
+                      site=nb_site['id'] if nb_site else 1,
+                      asset_tag=snipe_asset['asset_tag'],
+                      role=nb_role['id'],
+                      serial=snipe_asset['serial'],
+                      device_type=nb_device_type['id'],
+                      tenant=nb_tenant['id'] if nb_tenant is not None else None,
+                      custom_fields={KEY_CUSTOM_FIELD: snipe_asset['id']})
 
 
 
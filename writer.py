@@ -0,0 +1,125 @@
+import logging
+import threading
+from collections import Counter
+
+import pynetbox
+
+
+class BulkWriter:
+    """
+    Collects creates and updates per NetBox endpoint and sends them as bulk POST/PATCH requests.
+
+    Every queued item carries the Snipe object it was derived from, so failures can be reported per
+    object, and an optional callback which receives the record NetBox returned for it.
+    """
+
+    def __init__(self, netbox, endpoints: dict, batch_size: int = 100):
+        """
+        :param endpoints: object type -> pynetbox (app, endpoint) name
+        """
+        self.netbox = netbox
+        self.endpoints = endpoints
+        self.batch_size = max(1, batch_size)
+        self.lock = threading.RLock()
+        self.failures = []
+        # (object type, 'created', 'updated', 'skipped' or 'failed') -> number of objects
+        self.counts = Counter()
+        self.__queues = {}
+
+    def __endpoint(self, kind: str):
+        app, name = self.endpoints[kind]
+        return getattr(getattr(self.netbox, app), name)
+
+    def create(self, kind: str, data: dict, source=None, callback=None):
+        self.__queue(kind, 'create', data, source, callback)
+
+    def update(self, kind: str, data: dict, source=None, callback=None):
+        self.__queue(kind, 'update', data, source, callback)
+
+    def create_now(self, kind: str, data: dict):
+        """
+        Creates a single object right away, for objects whose id is needed immediately
+        """
+        record = self.__endpoint(kind).create(data)
+        with self.lock:
+            self.counts[(kind, 'created')] += 1
+        return record
+
+    def __queue(self, kind: str, method: str, data: dict, source, callback):
+        with self.lock:
+            queue = self.__queues.setdefault((kind, method), [])
+            queue.append((data, source, callback))
+            if len(queue) < self.batch_size:
+                return
+            batch = queue[:]
+            queue.clear()
+
+        self.__send(kind, method, batch)
+
+    def flush(self, kind: str = None):
+        """
+        Sends all queued items, or only those of one object type. Creates are sent before updates.
+        """
+        with self.lock:
+            keys = sorted((key for key in self.__queues if kind is None or key[0] == kind), key=lambda k: k[1] != 'create')
+            batches = [(key, self.__queues.pop(key)) for key in keys]
+
+        for (batch_kind, method), batch in batches:
+            if batch:
+                self.__send(batch_kind, method, batch)
+
+    def __send(self, kind: str, method: str, batch: list):
+        endpoint = self.__endpoint(kind)
+        payload = [data for data, _, _ in batch]
+
+        try:
+            records = endpoint.create(payload) if method == 'create' else endpoint.update(payload)
+        except pynetbox.RequestError as e:
+            if len(batch) == 1:
+                data, source, _ = batch[0]
+                self.failed(kind, method, source if source is not None else data, e)
+            else:
+                # bulk requests are atomic, so split the batch until the failing items are isolated
+                half = len(batch) // 2
+                self.__send(kind, method, batch[:half])
+                self.__send(kind, method, batch[half:])
+            return
+        except Exception as e:
+            # the request did not get through (connection error, timeout), none of the items were written
+            for data, source, _ in batch:
+                self.failed(kind, method, source if source is not None else data, e)
+            return
+
+        logging.debug("Sent {} {} {}".format(len(batch), kind, method))
+        with self.lock:
+            self.counts[(kind, 'created' if method == 'create' else 'updated')] += len(batch)
+        for record, (_, _, callback) in zip(records, batch):
+            if callback is not None:
+                callback(record)
+
+    def reset(self):
+        """
+        Clears the failures and counts, e.g. at the start of another sync
+        """
+        with self.lock:
+            self.failures = []
+            self.counts = Counter()
+
+    def failed(self, kind: str, method: str, source, error: Exception):
+        """
+        Records and logs a failed write, also used by the syncer for errors before anything was queued
+        """
+        with self.lock:
+            self.failures.append((kind, method, source, error))
+            self.counts[(kind, 'failed')] += 1
+        logging.error("---------------------------------------------------------")
+        logging.error("Error on {} of {} for {}".format(method, kind, source))
+        logging.error(error)
+
+    def skipped(self, kind: str, source=None, reason: str = None):
+        """
+        Counts an object left unchanged, because nothing changed or updating/linking is not enabled
+        :param reason: why a change was not made, None if nothing changed
+        """
+        with self.lock:
+            self.counts[(kind, 'skipped')] += 1